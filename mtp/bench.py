@@ -0,0 +1,222 @@
+#! /usr/bin/env python3
+
+import argparse
+import os
+import tempfile
+import time
+
+import gurobipy as grb
+
+import mtp
+
+from check_stp import same_instance
+from flow import flow_network, native
+from main import build_ilp_model, prepare_model, callback
+from stp import load_mtp, open_stp, write_stp
+
+DESCRIPTION = """
+ Benchmarks parts of the MTP solver on random instances.
+"""
+
+
+def bench_build(args):
+    """
+    Times build_ilp_model against the instance size
+    """
+    print("nodes", "edges", "vars", "constrs", "build")
+    for n in args.nodes:
+        g = mtp.random_instance(n, n * args.degree // 2,
+                                args.density, args.seed)
+
+        start = time.time()
+        model, x, y = build_ilp_model(g, args)
+        model.update()
+        end = time.time()
+
+        print(n, g.number_of_edges(), model.NumVars, model.NumConstrs,
+              end - start)
+
+
+def separation_round(F, x_bar, y_bar):
+    F.set_capacities(x_bar, y_bar)
+    for cut in F.min_cuts(F.nodes):
+        pass
+
+
+def bench_flow(args):
+    """
+    Times a full GSEC separation round at the root LP solution with the
+    Python and the native max flow
+    """
+    print("instance", "nodes", "edges", "python", "native",
+          "threads-{}".format(args.threads))
+    for path in args.instances:
+        with open(path) as fp:
+            g, _ = load_mtp(fp)
+
+        model, x, y = build_ilp_model(g, args)
+        model.Params.outputFlag = 0
+        model.setAttr("VType", model.getVars(),
+                      [grb.GRB.CONTINUOUS] * model.NumVars)
+        model.optimize()
+
+        x_val = model.getAttr("X", x)
+        y_val = model.getAttr("X", y)
+
+        timings = []
+        for use_native, threads in ((False, 1), (True, 1), (True, args.threads)):
+            if use_native and native is None:
+                timings.append("-")
+                continue
+
+            F = flow_network(g, use_native, threads)
+            x_bar = [x_val[e] for e in F.edges]
+            y_bar = [y_val[v, v] for v in F.nodes]
+
+            start = time.time()
+            for _ in range(args.rounds):
+                separation_round(F, x_bar, y_bar)
+            timings.append((time.time() - start) / args.rounds)
+
+        print(path, g.number_of_nodes(), g.number_of_edges(), *timings)
+
+
+def bench_heuristic(args):
+    """
+    Times the callbacks, and the primal heuristic and the node relaxation
+    queries within them, while solving random instances
+    """
+    print("nodes", "edges", "callbacks", "callback", "heuristics",
+          "heuristic", "relaxations", "values", "relaxation", "solve",
+          "objective")
+    for n in args.nodes:
+        g = mtp.random_instance(n, n * args.degree // 2,
+                                args.density, args.seed)
+
+        model, x, y = build_ilp_model(g, args)
+        model.Params.outputFlag = 0
+        prepare_model(g, model, x, y, args)
+
+        start = time.time()
+        model.optimize(lambda m, w: callback(g, x, y, m, w))
+        end = time.time()
+
+        print(n, g.number_of_edges(), *model._callback_time,
+              *model._heuristic_time, *model._node_rel_time, end - start,
+              model.objVal)
+
+
+def bench_parse(args):
+    """
+    Times load_mtp on generated instances written as stp files
+    """
+    print("nodes", "edges", "lines", "parse", "cached")
+    with tempfile.TemporaryDirectory() as directory:
+        for n in args.nodes:
+            g = mtp.random_instance(n, n * args.degree // 2,
+                                    args.density, args.seed)
+
+            path = os.path.join(directory, "{}.stp".format(n))
+            with open(path, "w") as fp:
+                write_stp(g, fp)
+            with open(path) as fp:
+                lines = sum(1 for _ in fp)
+
+            timings = []
+            for cache in (False, True, True):
+                start = time.time()
+                with open(path) as fp:
+                    load_mtp(fp, cache)
+                timings.append(time.time() - start)
+
+            # the first cached load writes the binary copy
+            print(n, g.number_of_edges(), lines, timings[0], timings[2])
+
+
+def bench_write(args):
+    """
+    Times write_stp on generated instances, plain and gzip compressed,
+    and checks that the files load back to the same instance. Float costs
+    and other formats are checked by check_stp.py.
+    """
+    print("nodes", "edges", "write", "size", "gzip", "gzip-size", "round-trip")
+    with tempfile.TemporaryDirectory() as directory:
+        for n in args.nodes:
+            g = mtp.random_instance(n, n * args.degree // 2,
+                                    args.density, args.seed)
+
+            row = [n, g.number_of_edges()]
+            same = True
+            for name in ("{}.stp", "{}.stp.gz"):
+                path = os.path.join(directory, name.format(n))
+                start = time.time()
+                with open_stp(path, "w") as fp:
+                    write_stp(g, fp)
+                row += [time.time() - start, os.path.getsize(path)]
+
+                with open_stp(path) as fp:
+                    h, _ = load_mtp(fp, cache=False)
+                same = same and same_instance(g, h)
+
+            print(*row, "ok" if same else "FAILED")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=DESCRIPTION)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--degree", type=int, default=4,
+                        help="Average node degree of the random instances")
+    parser.add_argument("--density", type=float, default=1.0,
+                        help="Share of assignment costs present")
+    subparsers = parser.add_subparsers(dest="bench")
+    subparsers.required = True
+
+    build = subparsers.add_parser("build", help="Time the model build")
+    build.add_argument("nodes", type=int, nargs="+",
+                       help="Instance sizes to build")
+    build.add_argument("--strengthen", action="store_true", default=False)
+    build.add_argument("--no-prune", action="store_true", default=False)
+    build.add_argument("--lazy-linking", action="store_true", default=False)
+    build.set_defaults(func=bench_build)
+
+    flow = subparsers.add_parser("flow", help="Time the GSEC max flows")
+    flow.add_argument("instances", nargs="+",
+                      help="MTP instances as stp files")
+    flow.add_argument("--rounds", type=int, default=5,
+                      help="Separation rounds to average over")
+    flow.add_argument("--threads", type=int, default=4,
+                      help="Threads for the parallel native timing")
+    flow.set_defaults(func=bench_flow, strengthen=False, no_prune=False,
+                      lazy_linking=False)
+
+    parse = subparsers.add_parser("parse", help="Time the stp parser")
+    parse.add_argument("nodes", type=int, nargs="+",
+                       help="Instance sizes to write and parse")
+    parse.set_defaults(func=bench_parse)
+
+    write = subparsers.add_parser("write", help="Time the stp writer")
+    write.add_argument("nodes", type=int, nargs="+",
+                       help="Instance sizes to write")
+    write.set_defaults(func=bench_write)
+
+    heuristic = subparsers.add_parser(
+        "heuristic", help="Time the callbacks and the primal heuristic")
+    heuristic.add_argument("nodes", type=int, nargs="+",
+                           help="Instance sizes to solve")
+    heuristic.add_argument("--max-cuts", type=int, default=25)
+    heuristic.add_argument("--time-limit", type=int, default=60)
+    heuristic.add_argument("--local-search", type=float, default=0)
+    heuristic.set_defaults(func=bench_heuristic, strengthen=False,
+                           no_prune=False, no_heuristics=False,
+                           no_native=False, threads=1, verify_cuts=False,
+                           debug=False, separation_interval=10,
+                           separation_nodes=100, separation_share=0.5,
+                           back_cuts=False, nested_cuts=0,
+                           min_cardinality=False, lazy_linking=False)
+
+    args = parser.parse_args()
+    args.func(args)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,119 @@
+#! /usr/bin/env python3
+
+import numpy as np
+
+import argparse
+import io
+import os
+import re
+import sys
+import tempfile
+
+import mtp
+
+from mtp import BIG_FLOAT
+from stp import load_mtp, open_stp, write_stp
+
+DESCRIPTION = """
+ Checks that random instances written by write_stp load back the same,
+ with integer and float costs, tab separated, with CRLF line ends, gzip
+ compressed and from the cache. Exits with 1 if any of them differ.
+"""
+
+DATA_LINE = re.compile(r'^(?:E|D) .*$', re.M)
+
+
+def same_instance(g, h):
+    """
+    Whether g and h have the same weighted edges and assignment costs
+    """
+    return sorted(g.edges(data="weight")) == sorted(h.edges(data="weight")) \
+        and np.array_equal(mtp.cost_matrix(g), mtp.cost_matrix(h))
+
+
+def float_instance(g):
+    """
+    Scales the edge weights and assignment costs of g down to fractions,
+    a share of which are still integral
+    """
+    for i, j, w in g.edges(data="weight"):
+        g[i][j]['weight'] = g[i][j]['_weight'] = w / 4
+    C = mtp.cost_matrix(g)
+    C[C < BIG_FLOAT] /= 8
+    return g
+
+
+def variants(text):
+    """
+    The stp text as written and reformatted the ways other writers do
+    """
+    def data_lines(f):
+        return DATA_LINE.sub(lambda m: f(m.group(0)), text)
+
+    return [
+        ("plain", text),
+        ("tabs", data_lines(lambda line: line.replace(' ', '\t'))),
+        ("crlf", text.replace('\n', '\r\n')),
+        # integral values without the .0, among the fractions
+        ("mixed", data_lines(lambda line: re.sub(r'\.0\b', '', line))),
+    ]
+
+
+def check(g, int_only, directory):
+    """
+    Writes g and loads it back in every variant. Returns the names of the
+    variants that differ from g.
+    """
+    out = io.StringIO()
+    write_stp(g, out)
+
+    failed = []
+    for name, text in variants(out.getvalue()):
+        h, h_int_only = load_mtp(io.StringIO(text), cache=False)
+        if not same_instance(g, h) or h_int_only != int_only:
+            failed.append(name)
+
+    for name in ("x.stp", "x.stp.gz"):
+        path = os.path.join(directory, name)
+        with open_stp(path, "w") as fp:
+            write_stp(g, fp)
+
+        # the first load parses the file and caches it, the second loads
+        # the cache
+        for source in ("file", "cache"):
+            with open_stp(path) as fp:
+                h, h_int_only = load_mtp(fp)
+            if not same_instance(g, h) or h_int_only != int_only:
+                failed.append("{} {}".format(name, source))
+    return failed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=DESCRIPTION)
+    parser.add_argument("nodes", type=int, nargs="*", default=[2, 30, 300],
+                        help="Instance sizes to check")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--degree", type=int, default=4,
+                        help="Average node degree of the random instances")
+    args = parser.parse_args()
+
+    ok = True
+    for n in args.nodes:
+        for density in (1.0, 0.3):
+            for costs in ("int", "float"):
+                m = min(n * args.degree // 2, n * (n - 1) // 2)
+                g = mtp.random_instance(n, max(n - 1, m), density, args.seed)
+                if costs == "float":
+                    g = float_instance(g)
+
+                with tempfile.TemporaryDirectory() as directory:
+                    failed = check(g, costs == "int", directory)
+                ok = ok and not failed
+                print(n, density, costs,
+                      "FAILED: " + ", ".join(failed) if failed else "ok")
+
+    sys.exit(0 if ok else 1)
+
+
+if __name__ == '__main__':
+    main()
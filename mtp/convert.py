@@ -10,8 +10,8 @@ import sys
 import argparse
 import itertools
 
-from stp import load_pcstp, write_stp
-from mtp import d, pairwise
+from stp import load_pcstp, open_stp, write_stp
+from mtp import empty_cost_matrix, pairwise
 
 DESCRIPTION = """
  Converts an STP PCSTP instance to a MTP instance using various methods:
@@ -40,8 +40,8 @@ def assignment_by_distance(g, be_int=True):
     """
     shortest = dict(nx.algorithms.all_pairs_dijkstra_path_length(g))
     avg_p = sum(g.node[v]["prize"] for v in g.nodes) / g.number_of_nodes()
+    C = empty_cost_matrix(g.number_of_nodes())
     for v in g.nodes:
-        d = {}
         p = g.node[v]["prize"] or avg_p
         dists = shortest[v]
         avg_dist = sum(dists.values()) * 1.0 / len(dists.values())
@@ -50,10 +50,10 @@ def assignment_by_distance(g, be_int=True):
             dist = dists[u] if u in dists else INF
             if p > 0 and u != v:
                 dist = p * (dist / avg_dist) if avg_dist else INF
-                d[u] = int(dist) if be_int else dist
+                C[v - 1, u - 1] = int(dist) if be_int else dist
             else:
-                d[u] = 0
-        g.node[v]["assignment_costs"] = d
+                C[v - 1, u - 1] = 0
+    g.graph["assignment_costs"] = C
 
     return g
 
@@ -62,18 +62,25 @@ def main():
     parser = argparse.ArgumentParser(description=DESCRIPTION)
 
     parser.add_argument("-f", help="The PCSTP instance as a stp file")
+    parser.add_argument("--output", "-o",
+                        help="The stp file to write, gzip compressed if it "
+                        "ends in .gz, stdout by default")
 
     args = parser.parse_args()
 
     if args.f:
-        with open(args.f) as fp:
+        with open_stp(args.f) as fp:
             g, N, int_only = load_pcstp(fp)
     else:
         g, N, int_only = load_pcstp(sys.stdin)
     connect_graph(g)
     assignment_by_distance(g)
 
-    write_stp(g)
+    if args.output:
+        with open_stp(args.output, "w") as out:
+            write_stp(g, out)
+    else:
+        write_stp(g)
 
 
 if __name__ == "__main__":
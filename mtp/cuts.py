@@ -0,0 +1,58 @@
+"""
+Pool of the GSECs separated at the MIPNODE callbacks
+"""
+import math
+
+
+class CutPool(object):
+    """
+    Remembers every cut added so far, keyed by its root and the frozenset
+    of its set S. Each separation round is a new round of the pool. Cuts
+    found again are skipped, and of the new ones only the most efficient
+    are added.
+    """
+
+    def __init__(self):
+        self.cuts = {}
+        self.round = 0
+        self.duplicates = 0
+        self.ages = 0
+
+    def new_round(self):
+        self.round += 1
+
+    def seen(self, key):
+        """
+        Whether the cut was added before, counting the hit if so
+        """
+        cut = self.cuts.get(key)
+        if cut is None:
+            return False
+
+        cut[1] += 1
+        self.duplicates += 1
+        self.ages += self.round - cut[0]
+        return True
+
+    @staticmethod
+    def efficacy(violation, terms):
+        return violation / math.sqrt(max(terms, 1))
+
+    def select(self, candidates, k):
+        """
+        The k candidates with the largest efficacy, which are recorded as
+        added. Candidates are (efficacy, root, S, ...) tuples and ties go
+        to the lower root.
+        """
+        candidates.sort(key=lambda c: (-c[0], c[1]))
+        selected = candidates[:k]
+        for cut in selected:
+            self.cuts[cut[1], frozenset(cut[2])] = [self.round, 0]
+        return selected
+
+    def report(self):
+        mean_age = self.ages / self.duplicates if self.duplicates else 0
+        hit = sum(1 for _, hits in self.cuts.values() if hits > 0)
+        return ("Cut pool: {} cuts in {} rounds, {} found again, "
+                "{} duplicates with mean age {:.1f} rounds").format(
+                    len(self.cuts), self.round, hit, self.duplicates, mean_age)
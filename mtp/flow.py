@@ -0,0 +1,578 @@
+"""
+Persistent max flow network for GSEC separation
+"""
+import numpy as np
+
+import ctypes
+import os
+
+from concurrent.futures import ThreadPoolExecutor, wait
+
+INF = float('inf')
+FLOW_EPSILON = 10**(-9)
+# added to the capacity of the edges leaving a cut to find the next
+# nested cut, the largest x_e so the edges no longer limit the flow
+NEST_CAPACITY = 1.0
+# added to the capacity of every support edge for minimal cardinality
+# cuts, so that of the min cuts the one over the fewest edges is found
+CARDINALITY_EPSILON = 10**(-6)
+
+# Built with `make native`
+NATIVE_LIB = os.environ.get('MAXFLOW_LIB', os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), os.pardir,
+    'rust', 'maxflow', 'target', 'release', 'libmaxflow.so'))
+
+
+def load_native(path=NATIVE_LIB):
+    """
+    Loads the compiled max flow kernel, None if it is not built
+    """
+    try:
+        lib = ctypes.CDLL(path)
+    except OSError:
+        return None
+
+    lib.network_new.restype = ctypes.c_void_p
+    lib.network_new.argtypes = [ctypes.c_size_t, ctypes.c_size_t,
+                                ctypes.c_void_p, ctypes.c_void_p]
+    lib.network_free.restype = None
+    lib.network_free.argtypes = [ctypes.c_void_p]
+    lib.network_set_capacities.restype = None
+    lib.network_set_capacities.argtypes = [ctypes.c_void_p, ctypes.c_void_p]
+    lib.network_min_cut.restype = ctypes.c_double
+    lib.network_min_cut.argtypes = [ctypes.c_void_p, ctypes.c_size_t,
+                                    ctypes.c_size_t, ctypes.c_size_t,
+                                    ctypes.c_void_p]
+    lib.network_open_cut.restype = ctypes.c_double
+    lib.network_open_cut.argtypes = [ctypes.c_void_p, ctypes.c_size_t]
+    lib.network_close_cut.restype = None
+    lib.network_close_cut.argtypes = [ctypes.c_void_p, ctypes.c_size_t,
+                                      ctypes.c_size_t, ctypes.c_size_t]
+    for side in (lib.network_source_side, lib.network_back_side):
+        side.restype = None
+        side.argtypes = [ctypes.c_void_p, ctypes.c_void_p]
+    lib.network_nest.restype = ctypes.c_double
+    lib.network_nest.argtypes = [ctypes.c_void_p, ctypes.c_void_p,
+                                 ctypes.c_size_t, ctypes.c_double]
+    for state in (lib.network_save, lib.network_restore):
+        state.restype = None
+        state.argtypes = [ctypes.c_void_p]
+    return lib
+
+
+native = load_native()
+
+
+def flow_network(G, use_native=True, threads=1, min_cardinality=False):
+    """
+    The separation network of G, backed by the compiled kernel when it is
+    available. With more than one thread the min cuts are solved in a
+    thread pool, which needs the kernel as it releases the GIL.
+    """
+    if use_native and native is not None:
+        if threads > 1:
+            return FlowPool(G, native, threads, min_cardinality)
+        return NativeFlowNetwork(G, native, min_cardinality)
+    return FlowNetwork(G, min_cardinality)
+
+
+class FlowNetwork(object):
+    """
+    The separation network of a graph, built once and reused for every
+    callback. Node v of the graph is index[v], followed by the source and
+    the sink.
+
+    The arcs are stored in pairs so the reverse of arc a is a ^ 1:
+
+    - 2e, 2e + 1: both directions of edge e, each with capacity x_e / 2
+    - 2m + 2k, 2m + 2k + 1: source to k and back
+    - 2m + 2n + 2k, 2m + 2n + 2k + 1: k to sink and back
+
+    The outgoing arcs of node v are adj[start[v]:start[v + 1]]. Only the
+    residual capacities are kept, the flow on arc a is res[a ^ 1] for the
+    source and sink arcs.
+
+    With min_cardinality the support edges get CARDINALITY_EPSILON more
+    capacity, and the cut values are taken from the capacities without it.
+    """
+
+    def __init__(self, G, min_cardinality=False):
+        self.nodes = sorted(G.nodes)
+        self.edges = list(G.edges)
+        self.index = {v: k for k, v in enumerate(self.nodes)}
+
+        n = len(self.nodes)
+        m = len(self.edges)
+        self.n = n
+        self.m = m
+        self.source = n
+        self.sink = n + 1
+
+        ends = np.array([(self.index[i], self.index[j])
+                         for i, j in self.edges], dtype=np.int64).reshape(m, 2)
+        self.ends = ends.ravel()
+
+        nodes = np.arange(n)
+        tails = np.empty(2 * m + 4 * n, dtype=np.int64)
+        heads = np.empty(2 * m + 4 * n, dtype=np.int64)
+        tails[0:2 * m:2], heads[0:2 * m:2] = ends[:, 0], ends[:, 1]
+        tails[1:2 * m:2], heads[1:2 * m:2] = ends[:, 1], ends[:, 0]
+        tails[2 * m:2 * m + 2 * n:2], heads[2 * m:2 * m + 2 * n:2] = self.source, nodes
+        tails[2 * m + 1:2 * m + 2 * n:2], heads[2 * m + 1:2 * m + 2 * n:2] = nodes, self.source
+        tails[2 * m + 2 * n::2], heads[2 * m + 2 * n::2] = nodes, self.sink
+        tails[2 * m + 2 * n + 1::2], heads[2 * m + 2 * n + 1::2] = self.sink, nodes
+
+        self.tails = tails
+        self.heads = heads
+        self.adj = np.argsort(tails, kind='mergesort')
+        self.start = np.searchsorted(tails[self.adj], np.arange(n + 3))
+
+        self.cap = np.zeros(2 * m + 4 * n)
+        self.exact_cap = self.cap
+        self.node_cap = np.zeros(n)
+        self.min_cardinality = min_cardinality
+
+        self._head = heads.tolist()
+        self._tail = tails.tolist()
+        self._adj = self.adj.tolist()
+        self._start = self.start.tolist()
+
+    def source_arc(self, k):
+        return 2 * self.m + 2 * k
+
+    def sink_arc(self, k):
+        return 2 * self.m + 2 * self.n + 2 * k
+
+    def set_capacities(self, x_bar, y_bar, sinks=()):
+        """
+        Sets the capacities from the LP values of the edges, in G.edges
+        order, and of the nodes, in sorted node order. Clears the flow.
+        The nodes in sinks start out forced to the sink side.
+        """
+        m = self.m
+        n = self.n
+
+        c = np.asarray(x_bar, dtype=np.float64) / 2
+        y_bar = np.asarray(y_bar, dtype=np.float64)
+
+        self.cap[0:2 * m:2] = c
+        self.cap[1:2 * m:2] = c
+        self.node_cap = np.bincount(self.ends, weights=np.repeat(c, 2),
+                                    minlength=n)
+        self.cap[2 * m:2 * m + 2 * n:2] = np.maximum(self.node_cap - y_bar, 0)
+        self.cap[2 * m + 2 * n::2] = np.maximum(y_bar - self.node_cap, 0)
+
+        for v in sinks:
+            self.cap[self.sink_arc(self.index[v])] = INF
+
+        self.exact_cap = self.cap
+        if self.min_cardinality:
+            self.exact_cap = self.cap.copy()
+            edge_cap = self.cap[:2 * m]
+            edge_cap[edge_cap > 0] += CARDINALITY_EPSILON
+
+        self.reset()
+
+    def reset(self):
+        self.res = self.cap.tolist()
+        self.value = 0
+
+    def source_capacity(self):
+        return self.cap[2 * self.m:2 * self.m + 2 * self.n:2].sum()
+
+    def min_cut(self, v):
+        """
+        Solves the max flow problem with v forced to the source side,
+        starting from the current flow. Returns the cut value and the
+        source side as graph nodes.
+
+        Afterwards v is forced to the sink side for the following cuts.
+        """
+        cut_val = self.open_cut(v)
+        S = self.source_side()
+        self.close_cut(v)
+        return cut_val, S
+
+    def cuts(self, v, back=False, nested=0):
+        """
+        The cuts of the max flow with v forced to the source side, as cut
+        values and source sides. The first is the cut of min_cut, the min
+        cut with the fewest nodes. With back the min cut with the most
+        nodes follows, and then up to nested cuts that each contain the
+        one before, found by raising the capacity of the edges leaving it
+        by NEST_CAPACITY and sending the flow that allows.
+
+        Afterwards v is forced to the sink side, as after min_cut.
+        """
+        cut_val = self.open_cut(v)
+        S = self.source_side()
+        exact = not self.min_cardinality
+        cuts = [(cut_val if exact else self.cut_value(S), S)]
+
+        if back:
+            B = self.back_side()
+            if B != S:
+                # the same value, it is a min cut as well
+                cuts.append((cut_val if exact else self.cut_value(B), B))
+
+        if nested > 0:
+            self.save()
+            for _ in range(nested):
+                self.nest(S)
+                N = self.source_side()
+                if N == S:
+                    break
+                S = N
+                if all(N != C for _, C in cuts):
+                    cuts.append((self.cut_value(N), N))
+            self.restore()
+
+        self.close_cut(v)
+        return cuts
+
+    def root_cuts(self, roots, back=False, nested=0, skip=()):
+        """
+        Yields every root along with its cuts, in turn. A root in skip,
+        which the caller may grow in between, is only forced to the sink
+        side when reached, so the cuts of the later roots are the same as
+        without skipping.
+        """
+        for v in roots:
+            if v in skip:
+                # with the source arc untouched this only forces v to the
+                # sink side
+                self.close_cut(v)
+                continue
+            yield v, self.cuts(v, back, nested)
+
+    def side_mask(self, S):
+        """
+        The source side S, with the source, as a mask of the network nodes
+        """
+        side = np.zeros(self.n + 2, dtype=bool)
+        side[[self.index[v] for v in S]] = True
+        side[self.source] = True
+        return side
+
+    def cut_value(self, S):
+        """
+        The capacity of the arcs leaving the source side S
+        """
+        side = self.side_mask(S)
+        return self.exact_cap[side[self.tails] & ~side[self.heads]].sum()
+
+    def open_cut(self, v):
+        """
+        Forces v to the source side and completes the max flow from the
+        current flow. Returns the cut value.
+        """
+        self.res[self.source_arc(self.index[v])] = INF
+        self.value += self._augment(self.source, self.sink)
+        return self.value
+
+    def close_cut(self, v):
+        """
+        Restores the source arc of v after open_cut and forces v to the
+        sink side
+        """
+        k = self.index[v]
+        s_arc = self.source_arc(k)
+        t_arc = self.sink_arc(k)
+        res = self.res
+
+        # restore the source arc, if it carries more than its capacity
+        # the surplus is routed back from the sink
+        flow = res[s_arc ^ 1]
+        capacity = self.cap[s_arc]
+        if flow > capacity:
+            res[s_arc] = 0
+            res[s_arc ^ 1] = capacity
+            self.value -= flow - capacity
+            self._augment(self.sink, k, flow - capacity)
+        else:
+            res[s_arc] = capacity - flow
+
+        res[t_arc] = INF
+
+    def save(self):
+        self.saved = (list(self.res), self.value)
+
+    def restore(self):
+        res, self.value = self.saved
+        self.res[:] = res
+
+    def nest(self, S):
+        """
+        Raises the capacity of the edge arcs leaving S by NEST_CAPACITY
+        and augments
+        """
+        side = self.side_mask(S)
+        tails = self.tails[:2 * self.m]
+        heads = self.heads[:2 * self.m]
+        for a in np.flatnonzero(side[tails] & ~side[heads]).tolist():
+            self.res[a] += NEST_CAPACITY
+        self.value += self._augment(self.source, self.sink)
+
+    def min_cuts(self, roots):
+        """
+        Yields the root, cut value and source side of min_cut for every
+        root in turn
+        """
+        for v in roots:
+            cut_val, S = self.min_cut(v)
+            yield v, cut_val, S
+
+    def source_side(self):
+        """
+        The graph nodes reachable from the source in the residual network
+        """
+        head = self._head
+        adj = self._adj
+        start = self._start
+        res = self.res
+
+        seen = [False] * (self.n + 2)
+        seen[self.source] = True
+        queue = [self.source]
+        for v in queue:
+            for a in adj[start[v]:start[v + 1]]:
+                w = head[a]
+                if not seen[w] and res[a] > FLOW_EPSILON:
+                    seen[w] = True
+                    queue.append(w)
+
+        return {self.nodes[k] for k in queue if k < self.n}
+
+    def back_side(self):
+        """
+        The graph nodes that can not reach the sink in the residual
+        network, the source side of the min cut with the most nodes
+        """
+        head = self._head
+        adj = self._adj
+        start = self._start
+        res = self.res
+
+        seen = [False] * (self.n + 2)
+        seen[self.sink] = True
+        queue = [self.sink]
+        for w in queue:
+            # v reaches w if the reverse of an arc out of w has capacity
+            for a in adj[start[w]:start[w + 1]]:
+                v = head[a]
+                if not seen[v] and res[a ^ 1] > FLOW_EPSILON:
+                    seen[v] = True
+                    queue.append(v)
+
+        return {self.nodes[k] for k in range(self.n) if not seen[k]}
+
+    def _levels(self, s, t):
+        head = self._head
+        adj = self._adj
+        start = self._start
+        res = self.res
+
+        level = [-1] * (self.n + 2)
+        level[s] = 0
+        queue = [s]
+        for v in queue:
+            for a in adj[start[v]:start[v + 1]]:
+                w = head[a]
+                if level[w] < 0 and res[a] > FLOW_EPSILON:
+                    level[w] = level[v] + 1
+                    queue.append(w)
+                    if w == t:
+                        return level
+        return level
+
+    def _augment(self, s, t, limit=INF):
+        """
+        Dinic's algorithm from s to t on the residual network, sending at
+        most limit. Returns the amount sent.
+        """
+        head = self._head
+        tail = self._tail
+        adj = self._adj
+        start = self._start
+        res = self.res
+
+        total = 0
+        while total < limit - FLOW_EPSILON:
+            level = self._levels(s, t)
+            if level[t] < 0:
+                break
+
+            ptr = start[:-1]
+            path = []
+            v = s
+            while total < limit - FLOW_EPSILON:
+                if v == t:
+                    f = min(limit - total, min(res[a] for a in path))
+                    for a in path:
+                        res[a] -= f
+                        res[a ^ 1] += f
+                    total += f
+                    path = []
+                    v = s
+                    continue
+
+                end = start[v + 1]
+                while ptr[v] < end:
+                    a = adj[ptr[v]]
+                    if res[a] > FLOW_EPSILON and level[head[a]] == level[v] + 1:
+                        break
+                    ptr[v] += 1
+
+                if ptr[v] < end:
+                    a = adj[ptr[v]]
+                    path.append(a)
+                    v = head[a]
+                elif v == s:
+                    break
+                else:
+                    # dead end, retreat
+                    level[v] = -1
+                    a = path.pop()
+                    v = tail[a]
+                    ptr[v] += 1
+        return total
+
+
+class NativeFlowNetwork(FlowNetwork):
+    """
+    FlowNetwork solved by the compiled kernel in rust/maxflow, which keeps
+    its own copy of the residual network.
+    """
+
+    def __init__(self, G, lib, min_cardinality=False):
+        super(NativeFlowNetwork, self).__init__(G, min_cardinality)
+
+        self._lib = lib
+        self._net = lib.network_new(self.n, len(self.tails),
+                                    self.tails.ctypes.data,
+                                    self.heads.ctypes.data)
+        self._side = np.zeros(self.n + 2, dtype=np.uint8)
+
+    def __del__(self):
+        if getattr(self, '_net', None):
+            self._lib.network_free(self._net)
+            self._net = None
+
+    def reset(self):
+        self._lib.network_set_capacities(self._net, self.cap.ctypes.data)
+
+    def min_cut(self, v):
+        k = self.index[v]
+        cut_val = self._lib.network_min_cut(self._net, k,
+                                            self.source_arc(k),
+                                            self.sink_arc(k),
+                                            self._side.ctypes.data)
+
+        S = np.flatnonzero(self._side[:self.n]).tolist()
+        return cut_val, {self.nodes[j] for j in S}
+
+    def open_cut(self, v):
+        return self._lib.network_open_cut(
+            self._net, self.source_arc(self.index[v]))
+
+    def close_cut(self, v):
+        k = self.index[v]
+        self._lib.network_close_cut(self._net, k, self.source_arc(k),
+                                    self.sink_arc(k))
+
+    def _read_side(self):
+        S = np.flatnonzero(self._side[:self.n]).tolist()
+        return {self.nodes[j] for j in S}
+
+    def source_side(self):
+        self._lib.network_source_side(self._net, self._side.ctypes.data)
+        return self._read_side()
+
+    def back_side(self):
+        self._lib.network_back_side(self._net, self._side.ctypes.data)
+        return self._read_side()
+
+    def save(self):
+        self._lib.network_save(self._net)
+
+    def restore(self):
+        self._lib.network_restore(self._net)
+
+    def nest(self, S):
+        side = self.side_mask(S).astype(np.uint8)
+        self._lib.network_nest(self._net, side.ctypes.data, 2 * self.m,
+                               NEST_CAPACITY)
+
+
+class FlowPool(object):
+    """
+    Solves the min cuts of a separation round on one NativeFlowNetwork per
+    thread. Each thread takes a chunk of consecutive roots and starts with
+    the earlier roots forced to the sink side, so the cuts are the same as
+    when solving the roots one after the other.
+    """
+
+    chunk = 16
+
+    def __init__(self, G, lib, threads, min_cardinality=False):
+        self.networks = [NativeFlowNetwork(G, lib, min_cardinality)
+                         for _ in range(threads)]
+        self.executor = ThreadPoolExecutor(threads)
+
+        self.nodes = self.networks[0].nodes
+        self.edges = self.networks[0].edges
+
+    def set_capacities(self, x_bar, y_bar):
+        self.x_bar = x_bar
+        self.y_bar = y_bar
+        self.networks[0].set_capacities(x_bar, y_bar)
+
+    def source_capacity(self):
+        return self.networks[0].source_capacity()
+
+    @staticmethod
+    def _solve(F, x_bar, y_bar, roots, sinks, back, nested):
+        F.set_capacities(x_bar, y_bar, sinks)
+        return list(F.root_cuts(roots, back, nested))
+
+    def min_cuts(self, roots):
+        """
+        Yields the same as FlowNetwork.min_cuts
+        """
+        cuts = self.root_cuts(roots)
+        try:
+            for v, ((cut_val, S),) in cuts:
+                yield v, cut_val, S
+        finally:
+            cuts.close()
+
+    def root_cuts(self, roots, back=False, nested=0, skip=()):
+        """
+        Yields the same as FlowNetwork.root_cuts. The roots are solved a
+        batch of one chunk per thread at a time, so stopping early only
+        wastes the rest of the current batch. The roots in skip are solved
+        ahead as well and only left out when their cuts are reached, which
+        gives the same cuts as every earlier root is on the sink side.
+        """
+        roots = list(roots)
+        batch = self.chunk * len(self.networks)
+        futures = []
+        try:
+            for start in range(0, len(roots), batch):
+                futures = []
+                for k, F in enumerate(self.networks):
+                    first = start + k * self.chunk
+                    if first >= len(roots):
+                        break
+                    futures.append(self.executor.submit(
+                        self._solve, F, self.x_bar, self.y_bar,
+                        roots[first:first + self.chunk], roots[:first],
+                        back, nested))
+
+                for future in futures:
+                    for v, cuts in future.result():
+                        if v not in skip:
+                            yield v, cuts
+        finally:
+            # the networks must be idle before they are used again
+            wait(futures)
@@ -0,0 +1,184 @@
+#! /usr/bin/env python3
+
+import networkx as nx
+import gurobipy as grb
+import numpy as np
+
+import argparse
+import random
+import time
+
+import mtp
+
+from stp import load_mtp
+from paths import ShortestPaths
+from local_search import local_search, penalized_costs
+from mtp import cost_matrix, edge_arrays
+
+DESCRIPTION = """
+ Finds a good MTP tree without a MIP, by multi start local search.
+"""
+
+
+def steiner_tree(G, paths, terminals):
+    """
+    Joins the terminals along the shortest paths of paths that make up a
+    minimum spanning tree of their distances, and returns the minimum
+    spanning tree of G on the nodes used
+    """
+    GS = nx.Graph()
+    GS.add_nodes_from(terminals)
+    for i in terminals:
+        for j in terminals:
+            if i >= j:
+                continue
+            GS.add_edge(i, j, weight=paths.distance(i, j))
+
+    mst = nx.algorithms.tree.minimum_spanning_tree(GS)
+
+    S = set(terminals)
+    for i, j in mst.edges:
+        S = S.union(paths.path(i, j))
+
+    return nx.algorithms.tree.minimum_spanning_tree(G.subgraph(S))
+
+
+def variable_support(G, y):
+    """
+    The pairs that have an assignment variable in y, as a |V| x |V| mask
+    """
+    n = G.number_of_nodes()
+    support = np.zeros((n, n), dtype=bool)
+    pairs = np.array(list(y.keys()), dtype=np.int64).reshape(-1, 2) - 1
+    support[pairs[:, 0], pairs[:, 1]] = True
+    return support
+
+
+def supported_tree(G, T, support):
+    """
+    Extends the tree T until every node can be assigned to one of its
+    nodes through a pair in the support mask. A node without one is joined
+    to the tree by its shortest path. That is no dearer than the assignment
+    if the pair was dropped by the shortest path test of assignment_support,
+    but may be if it was dropped by the single edge tree bound. Returns the
+    tree and the assignment of nearest_facility within the support, or None
+    and None if a node can not be reached.
+    """
+    S = set(T.nodes)
+    while True:
+        assigned, _ = mtp.nearest_facility(G, S, support)
+        missing = [v for v in G.nodes if not support[v - 1, assigned[v - 1] - 1]]
+        if not missing:
+            break
+        try:
+            _, path = nx.multi_source_dijkstra(G, S, target=missing[0],
+                                               weight="weight")
+        except nx.NetworkXNoPath:
+            return None, None
+        S.update(path)
+
+    if len(S) > T.number_of_nodes():
+        T = nx.algorithms.tree.minimum_spanning_tree(G.subgraph(S))
+    return T, assigned
+
+
+def hubs(G):
+    """
+    The nodes ordered by the cost of assigning every node to them alone
+    """
+    C = np.where(cost_matrix(G) < mtp.BIG_FLOAT, cost_matrix(G), np.inf)
+    np.fill_diagonal(C, 0)
+    return [v + 1 for v in np.argsort(C.sum(axis=0), kind='mergesort')]
+
+
+def solve(G, time_limit, starts=None, seed=None):
+    """
+    Runs local search from the best single hub and then from the trees of
+    random terminal sets, until starts trees have been tried or time_limit
+    seconds have passed. Returns the best tree and its cost.
+    """
+    deadline = time.time() + time_limit
+    rnd = random.Random(seed)
+
+    _, weights = edge_arrays(G)
+    paths = ShortestPaths(G)
+    paths.update(weights)
+    C = penalized_costs(G)
+
+    nodes = sorted(G.nodes)
+    best, best_cost = None, np.inf
+    k = 0
+    while starts is None or k < starts:
+        if k == 0:
+            T = nx.Graph()
+            T.add_node(hubs(G)[0])
+        else:
+            terminals = rnd.sample(nodes, rnd.randint(
+                2, max(2, int(len(nodes)**0.5))))
+            paths.solve(terminals)
+            T = steiner_tree(G, paths, terminals)
+
+        T = local_search(G, T.nodes, max(deadline - time.time(), 0), C)
+        cost = mtp.cost(T, G)
+        if cost < best_cost:
+            best, best_cost = T, cost
+
+        k += 1
+        if time.time() >= deadline:
+            break
+
+    return best, best_cost
+
+
+def set_start(G, T, x, y):
+    """
+    Sets the tree T as the MIP start of the model of build_ilp_model with
+    variables x and y. The tree is first extended by supported_tree, so
+    every node has an assignment that was not pruned from y. If that fails
+    the start is left undefined, for Gurobi to complete.
+    """
+    T, assigned = supported_tree(G, T, variable_support(G, y))
+    if T is None:
+        for v in list(x.values()) + list(y.values()):
+            v.Start = grb.GRB.UNDEFINED
+        return
+
+    for i, j in G.edges:
+        x[i, j].Start = 1 if T.has_edge(i, j) else 0
+
+    for (i, j), v in y.items():
+        v.Start = 1 if assigned[i - 1] == j else 0
+
+
+def main():
+    parser = argparse.ArgumentParser(description=DESCRIPTION)
+    parser.add_argument("mtp", help="The MTP instance as a stp file")
+    parser.add_argument("--time-limit", "-l", type=float, default=10,
+                        help="Seconds to search for")
+    parser.add_argument("--starts", type=int,
+                        help="The max number of trees to start from")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    with open(args.mtp) as fp:
+        g, _ = load_mtp(fp)
+
+    start = time.time()
+    T, cost = solve(g, args.time_limit, args.starts, args.seed)
+    end = time.time()
+
+    print("Facility:")
+    for i, j, w in T.edges(data="weight"):
+        print(i, j, w)
+    print("Assignments:")
+    assigned, assigned_costs = mtp.assignment(T, g)
+    for v in sorted(g.nodes):
+        if assigned[v - 1] != v:
+            print(v, assigned[v - 1], assigned_costs[v - 1])
+
+    print("Cost:", cost)
+    print("Time:", end - start)
+
+
+if __name__ == "__main__":
+    main()
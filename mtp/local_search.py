@@ -0,0 +1,177 @@
+"""
+Local search improvement of MTP trees
+"""
+import time
+
+import networkx as nx
+import numpy as np
+
+from mtp import BIG_FLOAT, cost_matrix, edge_arrays
+
+# smallest decrease of the cost for a move to be taken
+IMPROVEMENT = 10**(-6)
+
+
+def key_paths(T):
+    """
+    The paths of the tree T between its key nodes, the nodes that do not
+    have degree two, as node lists with only degree two nodes inside
+    """
+    key = {v for v in T if T.degree(v) != 2}
+    seen = set()
+    paths = []
+    for a in key:
+        for v in T.adj[a]:
+            path = [a, v]
+            while path[-1] not in key:
+                u, w = path[-2], path[-1]
+                path.append(next(z for z in T.adj[w] if z != u))
+            edge = frozenset(path[:2]) if path[0] < path[-1] \
+                else frozenset(path[-2:])
+            if edge not in seen:
+                seen.add(edge)
+                paths.append(path)
+    return paths
+
+
+def penalized_costs(G):
+    """
+    The cost matrix of G with the missing assignment costs replaced by more
+    than any tree costs, so that the changes add up without overflowing
+    """
+    C = cost_matrix(G)
+    finite = C < BIG_FLOAT
+    _, weights = edge_arrays(G)
+    penalty = C[finite].sum() + weights.sum() + 1
+    return np.where(finite, C, penalty)
+
+
+class TreeSearch(object):
+    """
+    A tree of G, given by its node set, along with the assignment costs of
+    all nodes to it. The tree is always the minimum spanning tree of the
+    subgraph induced by its nodes.
+
+    The moves estimate the change of the cost with the old tree edges,
+    and the tree is recomputed after a move is taken, so the real cost
+    is never above the estimate.
+
+    C is the matrix of penalized_costs, computed here if not given.
+    """
+
+    def __init__(self, G, nodes, C=None):
+        self.G = G
+        self.C = penalized_costs(G) if C is None else C
+
+        self.set_nodes(set(nodes))
+
+    def assignment_costs(self, S):
+        facilities = np.fromiter(S, dtype=np.int64) - 1
+        costs = self.C[:, facilities].min(axis=1)
+        costs[facilities] = 0
+        return costs
+
+    def set_nodes(self, S):
+        self.S = S
+        self.T = nx.minimum_spanning_tree(self.G.subgraph(S))
+        self.costs = self.assignment_costs(S)
+
+    def assignment_change(self, S):
+        """
+        The change of the assignment cost when the tree moves to S
+        """
+        return (self.assignment_costs(S) - self.costs).sum()
+
+    def insert(self, deadline):
+        """
+        Adds the neighbour of the tree that lowers the cost most, joined
+        by its cheapest edge to the tree
+        """
+        best, best_v = -IMPROVEMENT, None
+        for v in {w for u in self.S for w in self.G.adj[u]} - self.S:
+            if time.time() > deadline:
+                break
+            join = min(self.G.adj[v][u]["weight"]
+                       for u in self.G.adj[v] if u in self.S)
+            costs = np.minimum(self.costs, self.C[:, v - 1])
+            costs[v - 1] = 0
+            change = join + (costs - self.costs).sum()
+            if change < best:
+                best, best_v = change, v
+
+        if best_v is None:
+            return False
+        self.set_nodes(self.S | {best_v})
+        return True
+
+    def remove(self, deadline):
+        """
+        Drops the leaf of the tree whose removal lowers the cost most
+        """
+        if len(self.S) < 2:
+            return False
+
+        best, best_v = -IMPROVEMENT, None
+        for v in self.S:
+            if time.time() > deadline:
+                break
+            if self.T.degree(v) != 1:
+                continue
+            u = next(iter(self.T.adj[v]))
+            change = self.assignment_change(self.S - {v}) \
+                - self.T.adj[v][u]["weight"]
+            if change < best:
+                best, best_v = change, v
+
+        if best_v is None:
+            return False
+        self.set_nodes(self.S - {best_v})
+        return True
+
+    def exchange(self, deadline):
+        """
+        Replaces a key path of the tree with the shortest path in G that
+        joins the two parts of the tree left without it
+        """
+        for path in key_paths(self.T):
+            if time.time() > deadline:
+                break
+
+            inner = set(path[1:-1])
+            rest = self.T.subgraph(self.S - inner).copy()
+            if not inner:
+                rest.remove_edge(path[0], path[-1])
+            A = nx.node_connected_component(rest, path[0])
+            B = self.S - inner - A
+
+            dist, paths = nx.multi_source_dijkstra(self.G, A, weight="weight")
+            target = min(B, key=lambda v: dist.get(v, np.inf))
+            if target not in dist:
+                continue
+
+            S = (self.S - inner) | set(paths[target])
+            removed = sum(self.T.adj[u][v]["weight"]
+                          for u, v in zip(path, path[1:]))
+            change = dist[target] - removed + self.assignment_change(S)
+            if change < -IMPROVEMENT:
+                self.set_nodes(S)
+                return True
+        return False
+
+
+def local_search(G, nodes, budget, C=None):
+    """
+    Improves the tree of G spanning nodes with key path exchanges and node
+    insertions and removals, until none of them lowers the cost or budget
+    seconds have passed. Returns the tree.
+
+    C is the matrix of penalized_costs, to be computed once per instance
+    by callers that search repeatedly.
+    """
+    deadline = time.time() + budget
+    search = TreeSearch(G, nodes, C)
+    while time.time() < deadline:
+        if not (search.exchange(deadline) or search.insert(deadline)
+                or search.remove(deadline)):
+            break
+    return search.T
@@ -3,18 +3,25 @@
 import networkx as nx
 import gurobipy as grb
 import numpy as np
+from scipy import sparse
 
 import argparse
-import itertools
 import time
 import os
 
 from random import random
 
 import mtp
+import heuristic
 
 from stp import load_mtp
-from mtp import d, pairwise
+from flow import flow_network
+from cuts import CutPool
+from paths import ShortestPaths
+from local_search import local_search, penalized_costs
+from heuristic import set_start, steiner_tree, supported_tree, \
+    variable_support
+from mtp import d, assignment_support, cost_matrix, edge_arrays, pairwise
 
 DESCRIPTION = """
  Solves an instance of the MTP using Gurobi Python.
@@ -23,152 +30,310 @@ DESCRIPTION = """
 BIG_INT = np.iinfo(np.int64).max
 BIG_FLOAT = np.finfo(np.float64).max
 EPSILON = 10**(-5)
+# violated cuts collected for every cut added, to select from
+CANDIDATES_PER_CUT = 4
+# the root rounds stop once the bound gained less than TAIL_OFF, relative
+# to the bound, over the last TAIL_ROUNDS rounds
+TAIL_ROUNDS = 3
+TAIL_OFF = 10**(-3)
+# seconds of solve time before the separation time share is checked
+SHARE_MIN_TIME = 1.0
+# linking constraints of the cheapest assignments and edges of every node
+# that are in the model from the start with --lazy-linking
+SEED_LINKS = 2
 
 
 def edge(x, i, j):
     return x[i, j] if i <= j else x[j, i]
 
 
+def add_rows(model, variables, rows, cols, vals, sense, rhs):
+    """
+    Adds the block of constraints A v <sense> rhs in one call, where A is
+    given in coordinate form and v is the list of variables.
+    """
+    A = sparse.csr_matrix((vals, (rows, cols)),
+                          shape=(len(rhs), len(variables)))
+    return model.addMConstr(A, variables, sense, rhs)
+
+
+def cheapest(groups, keys, k):
+    """
+    Mask of the k entries with the lowest keys in every group
+    """
+    order = np.lexsort((keys, groups))
+    sorted_groups = groups[order]
+    rank = np.arange(len(order)) - np.searchsorted(sorted_groups,
+                                                    sorted_groups)
+    mask = np.zeros(len(order), dtype=bool)
+    mask[order[rank < k]] = True
+    return mask
+
+
 def build_ilp_model(g, args):
     model = grb.Model('mtp')
 
+    n = g.number_of_nodes()
+    edges, weights = edge_arrays(g)
+    m = len(edges)
+
+    # Only pairs that may be part of an optimal assignment get a variable
+    C = cost_matrix(g)
+    us, vs = np.nonzero(assignment_support(g, not args.no_prune))
+    a_costs = C[us, vs]
+    a_costs[a_costs == BIG_FLOAT] = 0
+
     # Edge Selection
-    x = model.addVars(g.edges, vtype=grb.GRB.BINARY)
+    x = model.addVars(g.edges, obj=weights.tolist(), vtype=grb.GRB.BINARY)
     # Vertex Assignment
-    y = model.addVars(((i, j)
-                      for i in g.nodes
-                      for j in g.nodes), vtype=grb.GRB.BINARY)
-
-    # OBJECTIVE
-    edge_costs = grb.quicksum(g[i][j]['weight'] * x[i, j] for i, j in g.edges)
-    assignment_cost = grb.quicksum(d(g, u, v) * y[u, v]
-                                   for u in g.nodes
-                                   for v in g.nodes)
-    model.setObjective(edge_costs + assignment_cost)
+    y = model.addVars(list(zip((us + 1).tolist(), (vs + 1).tolist())),
+                      obj=a_costs.tolist(), vtype=grb.GRB.BINARY)
+
+    # Column of every variable in the constraint matrix: x in g.edges order
+    # followed by y in (u, v) order
+    variables = list(x.values()) + list(y.values())
+    diagonal = us == vs
+    facility = np.empty(n, dtype=np.int64)
+    facility[us[diagonal]] = m + np.flatnonzero(diagonal)
+
+    ends = edges.ravel() - 1
+    edge_col = np.repeat(np.arange(m), 2)
+    off = np.flatnonzero(~diagonal)
+
+    # x[i, j] <= y[i, i] for both ends of every edge, and y[i, j] <= y[j, j]
+    # for every assignment. With lazy linking only the seed of the cheapest
+    # edges and assignments of every node, the callback adds the others.
+    gsec = np.arange(2 * m)
+    if args.lazy_linking:
+        gsec = gsec[cheapest(ends, np.repeat(weights, 2), SEED_LINKS)]
+        off = off[cheapest(us[off], C[us[off], vs[off]], SEED_LINKS)]
+    model._link_seed = (len(off), len(gsec))
+
+    ones = np.ones(len(gsec))
+    rows = np.arange(len(gsec))
 
     # one less edges than vertices
     model.addConstr(x.sum() == grb.quicksum(y[i, i] for i in g.nodes) - 1,
                     name='x.sum == y.sum - 1')
 
     # Add all |S| = 2 GSECS
-    for i, j in g.edges:
-        model.addConstr(x[i, j] <= y[i, i])
-        model.addConstr(x[i, j] <= y[j, j])  # ??
+    add_rows(model, variables,
+             np.concatenate((rows, rows)),
+             np.concatenate((edge_col[gsec], facility[ends[gsec]])),
+             np.concatenate((ones, -ones)),
+             grb.GRB.LESS_EQUAL, np.zeros(len(gsec)))
 
     # All Vertices must be assigned
-    for i in g.nodes:
-        model.addConstr(y.sum(i, '*') == 1)
+    add_rows(model, variables,
+             us, m + np.arange(len(us)), np.ones(len(us)),
+             grb.GRB.EQUAL, np.ones(n))
 
     # Only assign to vetrices in the facility
-    for i in g.nodes:
-        for j in g.nodes:
-            model.addConstr(y[i, j] <= y[j, j])
+    off_rows = np.arange(len(off))
+    add_rows(model, variables,
+             np.concatenate((off_rows, off_rows)),
+             np.concatenate((m + off, facility[vs[off]])),
+             np.concatenate((np.ones(len(off)), -np.ones(len(off)))),
+             grb.GRB.LESS_EQUAL, np.zeros(len(off)))
 
     # In the facility iff connected
-    for i in g.nodes:
-        model.addConstr(y[i, i] <=
-                        grb.quicksum(edge(x, i, j) for j in g.adj[i]))
-
-        if args.strengthen:
-            for j in g.adj[i]:
-                model.addConstr(y[i, i] >= edge(x, i, j))
+    add_rows(model, variables,
+             np.concatenate((np.arange(n), ends)),
+             np.concatenate((facility, edge_col)),
+             np.concatenate((np.ones(n), -np.ones(2 * m))),
+             grb.GRB.LESS_EQUAL, np.zeros(n))
+
+    # the same rows as the |S| = 2 GSECs, which lazy linking leaves out
+    if args.strengthen and not args.lazy_linking:
+        ones = np.ones(2 * m)
+        rows = np.arange(2 * m)
+        add_rows(model, variables,
+                 np.concatenate((rows, rows)),
+                 np.concatenate((facility[ends], edge_col)),
+                 np.concatenate((ones, -ones)),
+                 grb.GRB.GREATER_EQUAL, np.zeros(2 * m))
     return model, x, y
 
 
-def sum_edges(S, x):
-    lhs = grb.LinExpr()
-
-    for i, j in itertools.combinations(S, 2):
-        if (i, j) in x:
-            lhs.add(x[i, j])
-        elif (j, i) in x:
-            lhs.add(x[j, i])
-    return lhs
-
-
-def separate_gsec_rel(model, x, y, x_bar, y_bar, G):
-    F = nx.DiGraph()
-
-    F.add_node(-1)  # source
-    F.add_node(-2)  # sink
-    for v in G.node:
-        F.add_node(v)
-
+def incident_edges(G):
+    """
+    Maps every node to its neighbours along with the key of the edge
+    """
+    incident = {v: [] for v in G.nodes}
     for i, j in G.edges:
-        capacity = x_bar[i, j] / 2
-        F.add_edge(i, j, capacity=capacity)
-        F.add_edge(j, i, capacity=capacity)
-
-    total_source_cap = 0
-    for i in G.nodes:
-        node = F.node[i]
-
-        capacity = 0
-        for j in G.adj[i]:
-            capacity += F[i][j]['capacity']
-
-        node['capacity'] = capacity
-        source_cap = max(capacity - y_bar[i, i], 0)
-        F.add_edge(-1, i, capacity=source_cap)
-        F.add_edge(i, -2, capacity=max(y_bar[i, i] - capacity, 0))
-
-        total_source_cap += source_cap
-
-    cuts = 0
-    # solve max flow problems and collect cuts
-    for i in sorted(F.nodes):
-        if i < 0:
-            continue
-
-        i_capacity = F[-1][i]['capacity']
-        F[-1][i]['capacity'] = float('inf')
-
-        cut_val, cut = nx.minimum_cut(F, _s=-1, _t=-2)
-
-        S, T = cut
-
-        constr = -1 * (cut_val - total_source_cap) + y_bar[i, i]
-
-        S.discard(-1)
-
-        if constr - EPSILON > 0:
-            lhs = sum_edges(S, x)
-            rhs = grb.quicksum(y[v, v] for v in S if v != i)
-            model.cbCut(lhs <= rhs)
-            cuts += 1
-
-            rhs_bar = grb.quicksum(y_bar[v, v] for v in S if v != i)
-            lhs_bar = sum_edges(S, x_bar)
-            if lhs_bar.getValue() <= rhs_bar.getValue():
-                # print('not violated: ', lhs_bar.getValue(), '<=', rhs_bar.getValue())
-                pass
-            else:
-                pass
-
-        else:
-            rhs_bar = grb.quicksum(y_bar[v, v] for v in S if v != i).getValue()
-            lhs_bar = sum_edges(S, x_bar).getValue()
-            if lhs_bar > rhs_bar:
-                # print('violated: ', lhs_bar, '>', rhs_bar)
-                pass
-
-        F[-1][i]['capacity'] = i_capacity
-        F[i][-2]['capacity'] = float('inf')
-
-        if cuts >= model._args.max_cuts:
-            return cuts
-    return cuts
-
+        incident[i].append((j, (i, j)))
+        incident[j].append((i, (i, j)))
+    return incident
+
+
+def induced_edges(S, incident):
+    """
+    The edges of the subgraph induced by S, found through the incidence
+    index instead of all pairs of S
+    """
+    S = set(S)
+    return [e for i in S for j, e in incident[i] if i < j and j in S]
+
+
+def support_components(F, x_bar):
+    """
+    Maps every node on an edge with x_bar above EPSILON to the node set of
+    its connected component in the graph of these edges
+    """
+    support = nx.Graph()
+    support.add_edges_from(e for e in F.edges if x_bar[e] > EPSILON)
+    component = {}
+    for C in nx.connected_components(support):
+        for v in C:
+            component[v] = C
+    return component
+
+
+def separation_roots(component, y_bar):
+    """
+    The roots of the max flows of a separation round, the nodes in the
+    support graph with y_bar above EPSILON in decreasing y_bar order.
+
+    A set S without support edges is never violated, and a root with
+    y_bar zero only gives cuts that hold more strongly at a root of higher
+    y_bar in S. As the roots before, skipped or not, are forced to the
+    sink side, the root of every cut found has the largest y_bar of its
+    set.
+    """
+    return sorted((v for v in component if y_bar[v - 1] > EPSILON),
+                  key=lambda v: (-y_bar[v - 1], v))
 
-def add_gsecs(model, x, y, cycles):
-    for cycle in cycles:
-        ysum = grb.quicksum(y[v, v] for v in cycle)
 
-        lhs = sum_edges(cycle, x)
-
-        for k in cycle:
-            if lhs <= (ysum - y[k, k]):
-                model.cbLazy(lhs <= (ysum - y[k, k]))
+def separate_gsec_rel(model, x, y, x_bar, y_bar, G):
+    F = model._flow
+    F.set_capacities([x_bar[i, j] for i, j in F.edges], y_bar)
+
+    total_source_cap = F.source_capacity()
+
+    pool = model._cut_pool
+    pool.new_round()
+
+    # Checking every cut against x_bar is only done when verifying
+    verify = model._args.verify_cuts
+    false_pos = false_neg = 0
+
+    component = support_components(F, x_bar)
+    covered = set()
+    model._separation[0] += 1
+
+    # solve max flow problems and collect new violated cuts, every flow
+    # giving its min cut and the back and nested cuts asked for
+    candidates = []
+    found = set()
+    # the roots in a violated set found before are skipped
+    roots = separation_roots(component, y_bar)
+    for i, cuts in F.root_cuts(roots, model._args.back_cuts,
+                               model._args.nested_cuts, covered):
+        model._separation[1] += 1
+
+        for cut_val, S in cuts:
+            constr = -1 * (cut_val - total_source_cap) + y_bar[i - 1]
+
+            if constr - EPSILON > 0:
+                edges = None
+                if not S <= component[i]:
+                    # the part of S in the component of the root is a
+                    # sparser cut, if still violated
+                    S = S & component[i]
+                    edges = induced_edges(S, model._incident)
+                    constr = sum(x_bar[e] for e in edges) - \
+                        sum(y_bar[v - 1] for v in S if v != i)
+                    if constr - EPSILON <= 0:
+                        continue
+
+                covered |= S
+                key = (i, frozenset(S))
+                if key in found or pool.seen(key):
+                    continue
+                found.add(key)
+
+                if edges is None:
+                    edges = induced_edges(S, model._incident)
+                candidates.append((pool.efficacy(constr,
+                                                 len(edges) + len(S) - 1),
+                                   i, S, edges))
+
+            elif verify:
+                rhs_bar = sum(y_bar[v - 1] for v in S if v != i)
+                lhs_bar = sum(x_bar[e]
+                              for e in induced_edges(S, model._incident))
+                if lhs_bar > rhs_bar + EPSILON:
+                    false_neg += 1
+
+        if len(candidates) >= CANDIDATES_PER_CUT * model._args.max_cuts:
+            break
+
+    model._separation[2] += len(found)
+
+    # add the most efficient ones
+    cuts = pool.select(candidates, model._args.max_cuts)
+    for _, i, S, edges in cuts:
+        lhs = grb.LinExpr([1.0] * len(edges), [x[e] for e in edges])
+        rhs = grb.quicksum(y[v, v] for v in S if v != i)
+        model.cbCut(lhs <= rhs)
+
+        if verify and sum(x_bar[e] for e in edges) <= \
+           sum(y_bar[v - 1] for v in S if v != i) + EPSILON:
+            false_pos += 1
+
+    if verify:
+        model._cut_check[0] += false_pos
+        model._cut_check[1] += false_neg
+        print("Separation check:", len(cuts), "cuts,", false_pos,
+              "false positives,", false_neg, "false negatives")
+    return len(cuts)
+
+
+def cyclic_components(edges):
+    """
+    The node sets of the connected components of the graph given by edges
+    that contain a cycle, found with union find
+    """
+    edges = list(edges)
+    parent = {}
+
+    def find(v):
+        while parent[v] != v:
+            parent[v] = parent[parent[v]]
+            v = parent[v]
+        return v
+
+    for i, j in edges:
+        parent.setdefault(i, i)
+        parent.setdefault(j, j)
+        ri, rj = find(i), find(j)
+        if ri != rj:
+            parent[ri] = rj
+
+    components = {}
+    edge_count = {}
+    for v in parent:
+        components.setdefault(find(v), []).append(v)
+    for i, _ in edges:
+        r = find(i)
+        edge_count[r] = edge_count.get(r, 0) + 1
+
+    # a tree has one less edge than nodes
+    return [S for r, S in components.items() if edge_count[r] >= len(S)]
+
+
+def add_gsecs(model, x, y, components):
+    """
+    Adds x(E(S)) <= y(S) - y(k) for every component S, which all violate
+    it, with k the lowest node of S
+    """
+    for S in components:
+        edges = induced_edges(S, model._incident)
+        k = min(S)
+        others = [y[v, v] for v in S if v != k]
+
+        model.cbLazy(grb.LinExpr([1.0] * len(edges) + [-1.0] * len(others),
+                                 [x[e] for e in edges] + others) <= 0)
 
 
 def edge_weight(x, i, j):
@@ -191,64 +356,42 @@ def heuristics(G, x, y, x_val, y_val, model):
     limit = 0.7
     while len(selected) < 2:
         selected = {i for i in G.nodes
-                    if y_val[i, i] >= limit}
+                    if y_val[i - 1] >= limit}
         limit -= 0.1
         if limit < 0:
             return
 
     # selected = {i for i in G.nodes
-    #            if y_val[i, i] > random()}
-
-    for i, j in G.edges:
-        G[i][j]["lp_weight"] = 1 - edge_weight(x_val, i, j)
-
-    sp = dict(nx.shortest_path(G, weight="lp_weight"))
-
-    # spl = {u: {v: path_length_by_x(p, x_val)
-    #            for v, p in d.items()}
-    #        for u, d in sp.items()}
-
-    spl = dict(nx.shortest_path_length(G, weight="lp_weight"))
-
-    GS = nx.Graph()
-    for i in selected:
-        for j in selected:
-            if i >= j:
-                continue
-            GS.add_edge(i, j, weight=spl[i][j])
-
-    mst = nx.algorithms.tree.minimum_spanning_tree(GS)
-
-    S = set()
-    for i, j in mst.edges:
-        S = S.union(sp[i][j])
-
-    GH = G.subgraph(S)
-
-    mst = nx.algorithms.tree.minimum_spanning_tree(GH)
-
+    #            if y_val[i - 1] > random()}
+
+    paths = model._paths
+    paths.update(np.maximum(1 - np.fromiter(
+        (edge_weight(x_val, i, j) for i, j in G.edges),
+        dtype=np.float64, count=G.number_of_edges()), 0))
+    paths.solve(selected)
+
+    mst = steiner_tree(G, paths, selected)
+    S = set(mst.nodes)
+
+    if model._args.local_search > 0:
+        mst = local_search(G, S, model._args.local_search,
+                           model._search_costs)
+
+    # every node needs a facility it has a variable for, pruned pairs
+    # are replaced by extending the tree
+    mst, assigned = supported_tree(G, mst, model._support)
+    if mst is None:
+        return
+
+    # Gurobi completes any variable left out of a heuristic solution with a
+    # sub MIP, so the zeros are sent as well, one call per variable group
+    y_values = [0.0] * len(model._y_vars)
     for i in G.nodes:
-        for j in G.nodes:
-            model.cbSetSolution(y[i, j], 0)
-
-        other_node = -1
-        if i in S:
-            model.cbSetSolution(y[i, i], 1)
-        else:
-            min_cost = None
-            other_node = None
-            for j in S:
-                a_cost = d(G, i, j)
-                if min_cost is None:
-                    min_cost = a_cost
-                    other_node = j
-                elif a_cost <= min_cost:
-                    other_node = j
-                    min_cost = d(G, i, j)
-            model.cbSetSolution(y[i, other_node], 1)
-    for i, j in G.edges:
-        model.cbSetSolution(edge(x, i, j), 1
-                            if (i, j) in mst.edges else 0)
+        y_values[model._y_index[i, assigned[i - 1]]] = 1.0
+    model.cbSetSolution(model._y_vars, y_values)
+
+    model.cbSetSolution(model._x_vars, [1.0 if mst.has_edge(i, j) else 0.0
+                                        for i, j in G.edges])
 
     if model._args.debug:
         print("Heuristics cost:", mtp.cost(mst, G))
@@ -256,41 +399,225 @@ def heuristics(G, x, y, x_val, y_val, model):
     model._mst = mst
 
 
+def node_relaxation(model, x):
+    """
+    The node relaxation values of x, and of the facility indicators y[v, v]
+    as an array indexed by v - 1. The other y are only fetched for lazy
+    linking, into model._y_all, and the arrays are reused between calls.
+    """
+    start = time.time()
+    x_val = model.cbGetNodeRel(x)
+    if model._args.lazy_linking:
+        model._y_all[:] = model.cbGetNodeRel(model._y_vars)
+        model._y_bar[:] = model._y_all[model._diagonal]
+        fetched = len(model._y_vars)
+    else:
+        model._y_bar[:] = model.cbGetNodeRel(model._facility_vars)
+        fetched = len(model._facility_vars)
+
+    model._node_rel_time[0] += 1
+    model._node_rel_time[1] += len(x_val) + fetched
+    model._node_rel_time[2] += time.time() - start
+    return x_val, model._y_bar
+
+
+def separate_links(model, x_val, y_all, add):
+    """
+    Adds the linking constraints left out by lazy linking that x_val and
+    y_all, all y in model._y_vars order, violate, with add being cbCut or
+    cbLazy. Returns the number added.
+    """
+    y_bar = y_all[model._diagonal]
+    x_bar = np.fromiter((x_val[e] for e in model._edges), dtype=np.float64,
+                        count=len(model._edges))
+    y_vars = model._y_vars
+
+    # y[i, j] <= y[j, j]
+    links = model._links
+    violated = np.flatnonzero(y_all[links[:, 0]] - y_all[links[:, 1]]
+                              > EPSILON)
+    for k in violated.tolist():
+        add(y_vars[links[k, 0]] <= y_vars[links[k, 1]])
+    model._links_used.update(violated.tolist())
+
+    # x[i, j] <= y[i, i] and x[i, j] <= y[j, j]
+    ends = model._ends
+    violated_ends = np.flatnonzero(np.repeat(x_bar, 2) - y_bar[ends]
+                                   > EPSILON)
+    for r in violated_ends.tolist():
+        add(model._x_vars[r // 2] <= model._facility_vars[ends[r]])
+    model._edge_links_used.update(violated_ends.tolist())
+
+    return len(violated) + len(violated_ends)
+
+
+def separation_due(model, nodecount):
+    """
+    Whether to separate at the current node. At the root every round is
+    separated until the bound tails off. In the tree, the first nodes are
+    separated and after those one node in every interval, until the
+    separation takes more than its share of the solve time.
+    """
+    args = model._args
+    if args.max_cuts == 0:
+        return False
+    if nodecount == 0:
+        return not model._root_done
+    if model._separation_off:
+        return False
+
+    runtime = model.cbGet(grb.GRB.Callback.RUNTIME)
+    if runtime > SHARE_MIN_TIME and \
+       model._separation[4] > args.separation_share * runtime:
+        model._separation_off = True
+        return False
+
+    # the rounds at one node come with the same node count
+    return nodecount == model._separation_node \
+        or nodecount < args.separation_nodes \
+        or nodecount >= model._separation_node + args.separation_interval
+
+
+def root_round(model):
+    """
+    Records the bound after a root separation round, and ends the root
+    rounds if it tails off
+    """
+    bounds = model._root_bounds
+    bounds.append(model.cbGet(grb.GRB.Callback.MIPNODE_OBJBND))
+    if len(bounds) > TAIL_ROUNDS and bounds[-1] - bounds[-1 - TAIL_ROUNDS] \
+       <= TAIL_OFF * max(abs(bounds[-1]), 1):
+        model._root_done = True
+
+
 def callback(G, x, y, model, where):
+    start = time.time()
+
     if where == grb.GRB.callback.MIPSOL:
         x_val = model.cbGetSolution(x)
-        y_val = model.cbGetSolution(y)
 
-        g = nx.Graph()
+        if model._args.lazy_linking:
+            y_all = np.array(model.cbGetSolution(model._y_vars))
+            model._link_cuts[1] += separate_links(model, x_val, y_all,
+                                                  model.cbLazy)
 
-        for i, j in x_val.keys():
-            if x_val[i, j] > 0.5:
-                g.add_edge(i, j)
+        components = cyclic_components(e for e, v in x_val.items() if v > 0.5)
 
-        cycles = nx.cycle_basis(g)
+        add_gsecs(model, x, y, components)
 
-        add_gsecs(model, x, y, cycles)
+    elif where == grb.GRB.callback.MIPNODE and \
+            model.cbGet(grb.GRB.Callback.MIPNODE_STATUS) == grb.GRB.OPTIMAL:
+        # the relaxation is only available at nodes solved to optimality
+        x_val, y_val = node_relaxation(model, x)
 
-    elif where == grb.GRB.callback.MIPNODE:
-        x_val = model.cbGetNodeRel(x)
-        y_val = model.cbGetNodeRel(y)
+        if model._args.lazy_linking:
+            model._link_cuts[0] += separate_links(model, x_val, model._y_all,
+                                                  model.cbCut)
 
-        status = model.cbGet(grb.GRB.Callback.MIPNODE_STATUS)
         nodecount = model.cbGet(grb.GRB.Callback.MIPNODE_NODCNT)
-        if status == grb.GRB.OPTIMAL \
-           and model._args.max_cuts > 0:
+        if separation_due(model, nodecount):
+            separation_start = time.time()
             cuts = separate_gsec_rel(model, x, y, x_val, y_val, G)
-            if cuts > 0:
-                # print("Generated", cuts, "cuts.")
-                pass
-            # 0
-            # return
-
-        if status == grb.GRB.OPTIMAL \
-           and not model._args.no_heuristics \
+            model._separation[3] += cuts
+            model._separation[4] += time.time() - separation_start
+            model._separation_node = nodecount
+            if nodecount == 0:
+                root_round(model)
+
+        if not model._args.no_heuristics \
            and model._last_node < nodecount - 25:
             model._last_node = nodecount
+            heuristic_start = time.time()
             heuristics(G, x, y, x_val, y_val, model)
+            model._heuristic_time[0] += 1
+            model._heuristic_time[1] += time.time() - heuristic_start
+
+    if where in (grb.GRB.callback.MIPSOL, grb.GRB.callback.MIPNODE):
+        model._callback_time[0] += 1
+        model._callback_time[1] += time.time() - start
+
+
+def prepare_model(g, model, x, y, args, int_only=False):
+    """
+    Sets the parameters and the callback state of a model built by
+    build_ilp_model
+    """
+    model.Params.lazyConstraints = 1
+
+    if args.max_cuts > 0 or args.lazy_linking:
+        model.Params.preCrush = 1
+
+    if not args.no_heuristics:
+        # Disable Gurobi Heuristics
+        model.Params.heuristics = 0
+
+    if args.time_limit:
+        model.Params.timeLimit = args.time_limit
+
+    model._args = args
+    model._int_only = int_only
+    model._flow = flow_network(g, not args.no_native, args.threads,
+                               args.min_cardinality)
+    model._incident = incident_edges(g)
+    model._x_vars = [x[e] for e in g.edges]
+    model._y_vars = list(y.values())
+    model._y_index = {key: k for k, key in enumerate(y.keys())}
+    model._support = variable_support(g, y)
+    # the assignment costs of the local search, once for all its calls
+    model._search_costs = penalized_costs(g) \
+        if args.local_search > 0 else None
+    # the facility indicators in node order, the only y the callback reads
+    model._facility_vars = [y[v, v] for v in sorted(g.nodes)]
+    model._y_bar = np.zeros(len(model._facility_vars))
+
+    # the linking constraints as positions in _y_vars, for lazy linking:
+    # y[i, j] <= y[j, j] as the pairs of i, j and j, j, and x[i, j] <= y[i, i]
+    # by edge in _x_vars order and end i, as the index of i
+    pairs = np.array(list(y.keys()), dtype=np.int64).reshape(-1, 2)
+    model._diagonal = np.empty(len(model._facility_vars), dtype=np.int64)
+    on = pairs[:, 0] == pairs[:, 1]
+    model._diagonal[pairs[on, 0] - 1] = np.flatnonzero(on)
+    off = np.flatnonzero(~on)
+    model._links = np.column_stack((off, model._diagonal[pairs[off, 1] - 1]))
+    model._edges = list(g.edges)
+    model._ends = np.array(model._edges, dtype=np.int64).ravel() - 1
+    model._y_all = np.zeros(len(model._y_vars))
+    model.modelSense = grb.GRB.MINIMIZE
+
+    for v in g.nodes:
+        y[v, v].setAttr(grb.GRB.Attr.BranchPriority, 2)
+
+    reset_state(g, model)
+
+
+def reset_state(g, model):
+    """
+    Clears the callback state of the last solve, for solving the model
+    again after model.reset()
+    """
+    model._last_node = -49
+    # separation schedule: the last node separated, the root bounds after
+    # every round and whether separation stopped at the root or for good
+    model._separation_node = 0
+    model._root_bounds = []
+    model._root_done = False
+    model._separation_off = False
+    model._cut_check = [0, 0]
+    model._cut_pool = CutPool()
+    model._paths = ShortestPaths(g)
+    # calls and seconds spent in the heuristic and in the whole callback
+    model._heuristic_time = [0, 0.0]
+    model._callback_time = [0, 0.0]
+    # calls, values fetched and seconds of the node relaxation queries
+    model._node_rel_time = [0, 0, 0.0]
+    # linking constraints added by the callback, as positions in _links
+    # and _ends, and the number added as user cuts and as lazy constraints
+    model._links_used = set()
+    model._edge_links_used = set()
+    model._link_cuts = [0, 0]
+    # separation rounds, the max flows solved, the distinct violated cuts
+    # found and the cuts added in them, and the seconds spent
+    model._separation = [0, 0, 0, 0, 0.0]
 
 
 def main():
@@ -303,42 +630,72 @@ def main():
                         help="Repeat the optimisation n times - only makes sense with the -t switch",
                         type=int, default=1)
     parser.add_argument("--no-heuristics", action="store_true", default=False)
+    parser.add_argument("--start", type=float, default=0, metavar="<s>",
+                        help="Seconds of heuristic search for a MIP start, which counts to the solve time")
+    parser.add_argument("--local-search", type=float, default=0, metavar="<s>",
+                        help="Seconds to improve every heuristic solution with local search")
     parser.add_argument("--strengthen", action="store_true", default=False)
+    parser.add_argument("--no-prune", action="store_true", default=False,
+                        help="Keep assignment variables that can not be optimal")
+    parser.add_argument("--lazy-linking", action="store_true", default=False,
+                        help="Add the linking constraints of y and x to y[i, i] only when violated")
     parser.add_argument("--max-cuts", type=int, default=25,
                         help="The max number of user cuts to be made at each node")
+    parser.add_argument("--back-cuts", action="store_true", default=False,
+                        help="Also cut at the min cut with the most nodes of every max flow")
+    parser.add_argument("--nested-cuts", type=int, default=0, metavar="<k>",
+                        help="Find up to k nested cuts after the min cut of every max flow")
+    parser.add_argument("--min-cardinality", action="store_true", default=False,
+                        help="Of the min cuts of a max flow, find the one over the fewest edges")
+    parser.add_argument("--separation-interval", type=int, default=10, metavar="<k>",
+                        help="Separate at one of every k tree nodes after the first ones")
+    parser.add_argument("--separation-nodes", type=int, default=100, metavar="<n>",
+                        help="Separate at every one of the first n tree nodes")
+    parser.add_argument("--separation-share", type=float, default=0.5, metavar="<f>",
+                        help="Stop separating once it takes this share of the solve time")
+    parser.add_argument("--no-native", action="store_true", default=False,
+                        help="Use the Python max flow even if the native kernel is built")
+    parser.add_argument("--threads", type=int, default=1,
+                        help="Threads for the min cuts of the separation, needs the native kernel")
+    parser.add_argument("--verify-cuts", action="store_true", default=False,
+                        help="Check every separated cut against the node relaxation, implied by --debug")
+    parser.add_argument("--no-cache", action="store_true", default=False,
+                        help="Parse the stp file even if a binary copy is next to it")
     parser.add_argument("--debug", action="store_true", default=False)
     args = parser.parse_args()
+    args.verify_cuts = args.verify_cuts or args.debug
 
-    runs = []
+    start = time.time()
     with open(args.mtp) as fp:
-        g, int_only = load_mtp(fp)
+        g, int_only = load_mtp(fp, not args.no_cache)
+    parse_time = time.time() - start
 
-    for i in range(args.repeat):
-        if args.time is not None:
-            start = time.time()
-        model, x, y = build_ilp_model(g, args)
+    # the model is built once and reset between the repeated solves
+    start = time.time()
+    model, x, y = build_ilp_model(g, args)
+    prepare_model(g, model, x, y, args, int_only)
+    model.update()
+    build_time = time.time() - start
 
-        model.Params.lazyConstraints = 1
+    pairs = g.number_of_nodes()**2
+    print("Assignment variables: {} of {} ({:.1f}% pruned)".format(
+        len(y), pairs, 100.0 * (pairs - len(y)) / pairs))
 
-        if args.max_cuts > 0:
-            model.Params.preCrush = 1
-
-        if not args.no_heuristics:
-            # Disable Gurobi Heuristics
-            model.Params.heuristics = 0
-
-        if args.time_limit:
-            model.Params.timeLimit = args.time_limit
+    runs = []
+    for run in range(args.repeat):
+        if run > 0:
+            model.reset()
+            reset_state(g, model)
 
-        model._args = args
-        model._int_only = int_only
-        model._last_node = -49
-        model.modelSense = grb.GRB.MINIMIZE
+        start = time.time()
 
-        for v in g.nodes:
-            y[v, v].setAttr(grb.GRB.Attr.BranchPriority, 2)
+        if args.start > 0:
+            T, start_cost = heuristic.solve(g, args.start, seed=run)
+            set_start(g, T, x, y)
+            print("MIP start cost:", start_cost)
 
         model.optimize(lambda m, w: callback(g, x, y, m, w))
+        solve_time = time.time() - start
 
         x_val = model.getAttr("X", x)
         y_val = model.getAttr("X", y)
@@ -354,15 +711,47 @@ def main():
                 print(i, j, x_val[i, j], g.adj[i][j]["weight"])
                 g_fin.add_edge(i, j)
         print("Assignments:")
-        for i in g.nodes:
-            for j in g.nodes:
-                if y_val[i, j] > 0:
-                    print(i, j, y_val[i, j], d(g, i, j))
+        for i, j in y_val.keys():
+            if y_val[i, j] > 0:
+                print(i, j, y_val[i, j], d(g, i, j))
 
         print(model.status)
+        print("Callback: {} calls, {:.3f}s".format(*model._callback_time))
+        print("Node relaxation: {} calls, {} values, {:.3f}s".format(
+            *model._node_rel_time))
+        if not args.no_heuristics:
+            print("Heuristic: {} calls, {:.3f}s".format(*model._heuristic_time))
+            print("Heuristic shortest path trees: {} computed, {} reused".format(
+                model._paths.runs, model._paths.reused))
+        if args.max_cuts > 0:
+            rounds, flows, found, cuts, seconds = model._separation
+            print("Separation: {} rounds, {} max flows, {:.1f} per round, "
+                  "{} cuts, {:.3f}s".format(
+                      rounds, flows, flows / rounds if rounds else 0, cuts,
+                      seconds))
+            print("Violated cuts: {} found, {:.2f} per max flow".format(
+                found, found / flows if flows else 0))
+            print("Root: {} rounds, bound {}{}".format(
+                len(model._root_bounds),
+                model._root_bounds[-1] if model._root_bounds else "-",
+                ", tailed off" if model._root_done else ""))
+            if model._separation_off:
+                print("Separation switched off over its time share")
+            print(model._cut_pool.report())
+        if args.lazy_linking:
+            seed_links, seed_ends = model._link_seed
+            print("Linking constraints: {} of {} assignment links, {} of {} "
+                  "edge links, {} user cuts, {} lazy".format(
+                      seed_links + len(model._links_used), len(model._links),
+                      seed_ends + len(model._edge_links_used),
+                      len(model._ends), *model._link_cuts))
+        if args.verify_cuts:
+            print("Separation check total:", model._cut_check[0],
+                  "false positives,", model._cut_check[1], "false negatives")
+        print("Parse: {:.3f}s, build: {:.3f}s, solve: {:.3f}s".format(
+            parse_time, build_time, solve_time))
         if args.time is not None:
-            end = time.time()
-            runs.append((model.status, end - start, model.objBound, model.objVal))
+            runs.append((model.status, solve_time, model.objBound, model.objVal))
 
     if args.time is not None:
         directory = os.path.join(args.time, args.mtp.split("/")[-2])
@@ -374,11 +763,34 @@ def main():
 
         directory += "-MC{}".format(args.max_cuts)
 
+        # the options that change the model or the search, only when they
+        # are not the default so the names of older runs stay the same
+        if args.start > 0:
+            directory += "-ST{:g}".format(args.start)
+        if args.local_search > 0:
+            directory += "-LS{:g}".format(args.local_search)
+        if args.no_prune:
+            directory += "-NP"
+        if args.lazy_linking:
+            directory += "-LL"
+        if args.back_cuts:
+            directory += "-BC"
+        if args.nested_cuts > 0:
+            directory += "-NC{}".format(args.nested_cuts)
+        if args.min_cardinality:
+            directory += "-CARD"
+        for key, code in (("separation_interval", "SI"),
+                          ("separation_nodes", "SN"),
+                          ("separation_share", "SS")):
+            if getattr(args, key) != parser.get_default(key):
+                directory += "-{}{:g}".format(code, getattr(args, key))
+
         if not os.path.exists(directory):
             os.makedirs(directory)
         with open(os.path.join(directory, filename), "w") as f:
             for st, timing, bound, obj in runs:
-                print(g.number_of_nodes(), g.number_of_edges(), st, timing, bound, obj, file=f)
+                print(g.number_of_nodes(), g.number_of_edges(), st, timing, bound, obj,
+                      parse_time, build_time, file=f)
 
 
 if __name__ == "__main__":
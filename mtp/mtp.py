@@ -3,8 +3,12 @@ Utilities for the MTP problem on a NetworkX Graph
 """
 import numpy as np
 import networkx as nx
+import itertools
 import random
 
+from scipy import sparse
+from scipy.sparse import csgraph
+
 BIG_INT = np.iinfo(np.int64).max
 BIG_FLOAT = np.finfo(np.float64).max
 
@@ -21,42 +25,160 @@ def pairwise(it):
         two = next(it)
 
 
+def empty_cost_matrix(n):
+    """
+    An empty |V| x |V| assignment cost matrix. Node v is row and column
+    v - 1 and BIG_FLOAT marks pairs without an assignment cost.
+    """
+    return np.full((n, n), BIG_FLOAT, dtype=np.float64)
+
+
+def cost_matrix(g):
+    """
+    The assignment cost matrix of g
+    """
+    return g.graph['assignment_costs']
+
+
+def edge_arrays(g):
+    """
+    The edges of g as an (m, 2) array of node labels along with an (m,)
+    array of their weights, both in g.edges order.
+    """
+    m = g.number_of_edges()
+    edges = np.fromiter(itertools.chain.from_iterable(g.edges),
+                        dtype=np.int64, count=2 * m).reshape(m, 2)
+    weights = np.fromiter((w for _, _, w in g.edges(data="weight")),
+                          dtype=np.float64, count=m)
+    return edges, weights
+
+
 def d(g, u, v):
-    try:
-        return g.node[u]['assignment_costs'].get(v, BIG_FLOAT)
-    except Exception as e:
-        print(u, v)
-        raise e
+    return g.graph['assignment_costs'][u - 1, v - 1]
 
 
 def cost(T, G):
-    cost = 0
-    assignment(T, G)
+    _, assigned_costs = assignment(T, G)
 
     # edge costs
-    for _, _, w in T.edges(data="weight"):
-        cost += w
+    cost = sum(w for _, _, w in T.edges(data="weight"))
 
     # assignment costs
-    for i, (_, c) in G.nodes(data='assigned'):
-        cost += c
+    return cost + assigned_costs.sum()
+
+
+def nearest_facility(G, facilities, support=None):
+    """
+    The cheapest of the facility nodes for every node of G, with one argmin
+    over the facility columns of the cost matrix. Returns the assigned
+    nodes and their assignment costs as arrays indexed by v - 1, the
+    facility nodes are assigned to themselves for free.
+
+    With a support mask as of assignment_support, only the pairs in it are
+    candidates. A node without any is assigned at BIG_FLOAT.
+    """
+    facilities = np.fromiter(facilities, dtype=np.int64)
+
+    candidates = cost_matrix(G)[:, facilities - 1]
+    if support is not None:
+        candidates = np.where(support[:, facilities - 1], candidates,
+                              BIG_FLOAT)
+    best = np.argmin(candidates, axis=1)
+
+    assigned = facilities[best]
+    assigned_costs = candidates[np.arange(len(candidates)), best]
+
+    assigned[facilities - 1] = facilities
+    assigned_costs[facilities - 1] = 0
 
-    return cost
+    return assigned, assigned_costs
 
 
 def assignment(T, G):
+    """
+    Assigns every node of G to its cheapest node in T. Returns the assigned
+    nodes and their assignment costs as arrays indexed by v - 1.
+    """
+    assigned, assigned_costs = nearest_facility(G, T.nodes)
+
     for v in G.nodes:
-        if v in T.nodes:
-            G.node[v]['assigned'] = v, 0
-        else:
-            other_node = None
-            cost = -1
-            for u in T.nodes:
-                c = d(G, v, u)
-                if other_node is None or c < cost:
-                    other_node = u
-                    cost = c
-            G.node[v]['assigned'] = other_node, cost
+        G.node[v]['assigned'] = assigned[v - 1], assigned_costs[v - 1]
+
+    return assigned, assigned_costs
+
+
+def assignment_support(g, prune=True):
+    """
+    The (u, v) pairs that may be used by an optimal assignment as a
+    |V| x |V| boolean mask. Pairs without an assignment cost are never
+    needed, and the facility pairs (v, v) are always kept.
+
+    With prune, the pairs that can not be optimal are dropped as well. This
+    is only done when all costs are non negative and d(v, v) = 0, as then
+    adding nodes to the tree never increases the assignment cost:
+
+    - d(u, v) larger than the shortest path from u to v, since extending
+      the tree along that path to u is cheaper than assigning u to v.
+    - d(u, v) larger than the cost of the best tree with a single edge.
+    """
+    C = cost_matrix(g)
+    support = C < BIG_FLOAT
+    np.fill_diagonal(support, True)
+
+    edges, weights = edge_arrays(g)
+    if not prune or len(edges) == 0 \
+       or np.any(np.diag(C) != 0) \
+       or np.any(C < 0) or np.any(weights < 0):
+        return support
+
+    n = g.number_of_nodes()
+    W = sparse.csr_matrix((weights, (edges[:, 0] - 1, edges[:, 1] - 1)),
+                          shape=(n, n))
+    support &= C <= csgraph.dijkstra(W, directed=False)
+
+    # cost of every single edge tree, a block of edges at a time
+    bound = np.inf
+    D = np.where(C < BIG_FLOAT, C, np.inf)
+    for k in range(0, len(edges), 1024):
+        us = edges[k:k + 1024, 0] - 1
+        vs = edges[k:k + 1024, 1] - 1
+        trees = np.minimum(D[:, us], D[:, vs]).sum(axis=0)
+        bound = min(bound, np.min(trees + weights[k:k + 1024]))
+    support &= C <= bound
+
+    np.fill_diagonal(support, True)
+    return support
+
+
+def random_instance(n, m, density=1.0, seed=None):
+    """
+    A random connected MTP instance with n nodes and m >= n - 1 edges,
+    where a share of roughly density of the assignment costs is present.
+    """
+    rnd = random.Random(seed)
+
+    g = nx.Graph()
+    for i in range(1, n + 1):
+        g.add_node(i, prize=0, _prize=0)
+
+    # a random spanning tree keeps the graph connected
+    for v in range(2, n + 1):
+        w = rnd.randint(1, 100)
+        g.add_edge(rnd.randint(1, v - 1), v, weight=w, _weight=w)
+
+    while g.number_of_edges() < m:
+        u, v = rnd.sample(range(1, n + 1), 2)
+        if not g.has_edge(u, v):
+            w = rnd.randint(1, 100)
+            g.add_edge(u, v, weight=w, _weight=w)
+
+    state = np.random.RandomState(seed)
+    C = state.randint(1, 1000, size=(n, n)).astype(np.float64)
+    C[state.random_sample((n, n)) >= density] = BIG_FLOAT
+    np.fill_diagonal(C, 0)
+    g.graph['assignment_costs'] = C
+
+    return g
 
 
 def getrec(di, x):
@@ -106,29 +228,21 @@ def truncate(g, n, m):
 
     # fix assignments
     # first for contracted nodes
+    C = cost_matrix(g).copy()
     for u in assignment_map:
         v = getrec(assignment_map, u)
         # u has been contracted to v
         # we take the lowest assignment cost unless zero
-        new_assignments = {}
-        for i in gp.nodes:
-            du = d(g, u, i)
-            dv = d(g, v, i)
-
-            if du == 0:
-                new_assignments[i] = dv
-            elif dv == 0:
-                new_assignments[i] = du
-            else:
-                new_assignments[i] = min(dv, du)
+        du = cost_matrix(g)[u - 1]
+        dv = cost_matrix(g)[v - 1]
 
-        gp.nodes[v]['assignment_costs'] = new_assignments
+        C[v - 1] = np.where(du == 0, dv,
+                            np.where(dv == 0, du, np.minimum(du, dv)))
 
     # remove all non existant assignments
-
-    for i in gp.nodes:
-        gp.node[i]['assignment_costs'] = {k: v for k, v in gp.node[i]['assignment_costs'].items()
-                                          if k in gp}
+    keep = np.fromiter(gp.nodes, dtype=np.int64,
+                       count=gp.number_of_nodes()) - 1
+    C = C[np.ix_(keep, keep)]
 
     # relabel nodes to run from 1 to N
     j = 1
@@ -137,9 +251,7 @@ def truncate(g, n, m):
         # i is now j
         bmap[i] = j
         j += 1
-    lmap = {v: k for k, v in bmap.items()}
     gpp = nx.relabel_nodes(gp, bmap)
 
-    for i in gpp.nodes:
-        gpp.node[i]['assignment_costs'] = {bmap[k]: v for k, v in gp.node[lmap[i]]['assignment_costs'].items()}
+    gpp.graph['assignment_costs'] = C
     return gpp
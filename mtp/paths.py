@@ -0,0 +1,95 @@
+"""
+Shortest paths between the terminals of the primal heuristic
+"""
+import numpy as np
+
+from scipy import sparse
+from scipy.sparse import csgraph
+
+# largest change of an edge weight for which the trees are kept
+WEIGHT_TOLERANCE = 10**(-2)
+
+
+class ShortestPaths(object):
+    """
+    Shortest path trees from single terminals of a graph, under edge
+    weights that change between calls. The graph is stored once as a
+    sparse matrix and only its weights are rewritten.
+
+    The trees are kept as long as no edge weight moved by more than
+    tolerance since they were computed, so a call with nearly the same
+    weights only runs Dijkstra for the terminals it has not seen yet.
+    """
+
+    def __init__(self, G, tolerance=WEIGHT_TOLERANCE):
+        self.nodes = sorted(G.nodes)
+        self.index = {v: k for k, v in enumerate(self.nodes)}
+        self.tolerance = tolerance
+
+        n = len(self.nodes)
+        m = G.number_of_edges()
+        rows = np.fromiter((self.index[i] for i, _ in G.edges),
+                           dtype=np.int64, count=m)
+        cols = np.fromiter((self.index[j] for _, j in G.edges),
+                           dtype=np.int64, count=m)
+
+        # the stored entries are the edge numbers, to find where the weight
+        # of every edge goes
+        self.W = sparse.csr_matrix((np.arange(1, m + 1, dtype=np.float64),
+                                    (rows, cols)), shape=(n, n))
+        self.order = self.W.data.astype(np.int64) - 1
+
+        self.weights = None
+        self.dist = {}
+        self.pred = {}
+        self.runs = 0
+        self.reused = 0
+
+    def update(self, weights):
+        """
+        Sets the edge weights, in G.edges order. The trees are dropped
+        unless the weights are within tolerance of the ones they were
+        computed with.
+        """
+        weights = np.asarray(weights, dtype=np.float64)
+        if self.weights is not None and \
+           np.all(np.abs(weights - self.weights) <= self.tolerance):
+            return
+
+        self.weights = weights
+        self.W.data = weights[self.order]
+        self.dist = {}
+        self.pred = {}
+
+    def solve(self, terminals):
+        """
+        Runs Dijkstra from every terminal without a tree, all in one call
+        """
+        missing = [t for t in terminals if t not in self.dist]
+        self.reused += len(terminals) - len(missing)
+        if not missing:
+            return
+
+        dist, pred = csgraph.dijkstra(self.W, directed=False,
+                                      indices=[self.index[t] for t in missing],
+                                      return_predecessors=True)
+        for k, t in enumerate(missing):
+            self.dist[t] = dist[k]
+            self.pred[t] = pred[k]
+        self.runs += len(missing)
+
+    def distance(self, u, v):
+        return self.dist[u][self.index[v]]
+
+    def path(self, u, v):
+        """
+        The nodes on the shortest path from the terminal u to v
+        """
+        pred = self.pred[u]
+        k = self.index[v]
+        p = [v]
+        while pred[k] >= 0:
+            k = pred[k]
+            p.append(self.nodes[k])
+        p.reverse()
+        return p
@@ -1,159 +1,309 @@
 import networkx as nx
-from mtp import d, BIG_FLOAT
+import numpy as np
 
-INF = float('inf')
+import gzip
+import os
+import re
+import sys
 
+from mtp import empty_cost_matrix, cost_matrix, BIG_FLOAT
 
-def is_int(s):
-    try:
-        int(s)
-        return True
-    except ValueError:
-        return False
+INF = float('inf')
 
+# deletes what integers are written with, anything left makes a float
+INT_CHARS = str.maketrans('', '', '0123456789+- \t\r\n')
+SECTION = re.compile(r'^SECTION[ \t]+(\S+).*$', re.M)
 
-def chomp_section(f):
-    for line in f:
-        if line.startswith('END'):
+
+def sections(fp):
+    """
+    Reads the whole file and yields the name and the body of every
+    section, the text between its SECTION and END lines
+    """
+    text = fp.read()
+    pos = 0
+    while True:
+        header = SECTION.search(text, pos)
+        if header is None:
             return
+        end = text.find('\nEND', header.end())
+        if end < 0:
+            end = len(text)
+        yield header.group(1), text[header.end() + 1:end + 1]
+        pos = end + 1
+
+
+def read_rows(body, key, columns):
+    """
+    Parses the lines of a section body that start with key and a space or
+    tab, all at once, into an array with a row of the columns after the
+    key for every line. The array is int64 if all values are integers and
+    float64 otherwise. Returns the array and the other lines of the body.
 
+    Raises ValueError if the lines of key do not all hold columns numbers.
+    """
+    text = '\n' + body
+    other = []
+    count = text.count('\n' + key + ' ')
+    if count == text.count('\n') - 1:
+        data = text.replace('\n' + key + ' ', '\n')
+    else:
+        key_re = re.escape(key) + r'[ \t]'
+        others = re.compile(r'^(?!{}).+$'.format(key_re), re.M)
+        other = others.findall(text)
+        data, count = re.subn(r'^' + key_re, '', others.sub('', text),
+                              flags=re.M)
 
-def grow_graph(f, g):
-    int_only = True
-    for line in f:
+    if count == 0:
+        return np.empty((0, columns), dtype=np.int64), other
+
+    dtype = np.float64 if data.translate(INT_CHARS) else np.int64
+    values = np.fromstring(data, dtype=dtype, sep=' ')
+    if len(values) != count * columns:
+        raise ValueError("{} {} lines of {} numbers expected, {} numbers "
+                         "read".format(count, key, columns, len(values)))
+    return values.reshape(-1, columns), other
+
+
+def read_graph(body):
+    """
+    The number of nodes, the edges as an (m, 2) array and their weights
+    of a Graph section
+    """
+    rows, other = read_rows(body, 'E', 3)
+
+    num_nodes = 0
+    for line in other:
         if line.startswith('Nodes'):
             _, num_nodes = line.strip().split()
             num_nodes = int(num_nodes)
-            for i in range(1, num_nodes + 1):
-                g.add_node(i, prize=0, _prize=0)
-            continue
-        if line.startswith('Edges'):
-            continue
-        if line.startswith('END'):
-            break
-
-        _, v, u, w = line.strip().split()
-        u = int(u)
-        v = int(v)
-        if is_int(w):
-            w = int(w)
-        else:
-            w = float(w)
-            int_only = False
-
-        g.add_edge(u, v, weight=w, _weight=w)
-    return int_only
-
-
-def add_terminal_prizes(f, g):
-    N = set()
-    int_only = True
-    for line in f:
-        if line.startswith('Terminals'):
-            continue
-        if line == 'END\n':
-            break
-        _, v, p = line.strip().split()
-        v = int(v)
-        if is_int(p):
-            p = int(p)
-        else:
-            p = float(p)
-            int_only = False
-        N.add(v)
-        g.node[v]['prize'] = g.node[v]['_prize'] = p
 
-    return N, int_only
+    edges = rows[:, [1, 0]].astype(np.int64)
+    return num_nodes, edges, rows[:, 2]
+
 
+def read_terminals(body):
+    """
+    The terminals and their prizes of a Terminals section
+    """
+    rows, _ = read_rows(body, 'TP', 2)
+    return rows[:, 0].astype(np.int64), rows[:, 1]
 
-def add_assignment_costs(f, g):
-    int_only = True
 
-    for line in f:
-        if line.startswith('AssignmentCosts'):
-            continue
-        if line == 'END\n':
-            break
-        _, u, v, c = line.strip().split()
-        u = int(u)
-        v = int(v)
-        if is_int(c):
-            c = int(c)
-        else:
-            c = float(c)
-            int_only = False
+def read_assignment_costs(body, num_nodes):
+    """
+    The cost matrix of an AssignmentCosts section, and whether all costs
+    are integers
+    """
+    rows, _ = read_rows(body, 'D', 3)
+
+    C = empty_cost_matrix(num_nodes)
+    us = rows[:, 0].astype(np.int64)
+    vs = rows[:, 1].astype(np.int64)
+    C[us - 1, vs - 1] = rows[:, 2]
+
+    return C, rows.dtype == np.int64
+
+
+def no_sections():
+    """
+    The arrays of a file without a Graph section
+    """
+    return {'nodes': 0, 'edges': np.empty((0, 2), dtype=np.int64),
+            'weights': np.empty(0, dtype=np.int64)}
+
+
+def build_graph(num_nodes, edges, weights):
+    g = nx.Graph()
+    for i in range(1, num_nodes + 1):
+        g.add_node(i, prize=0, _prize=0)
+
+    g.add_edges_from((u, v, {'weight': w, '_weight': w})
+                     for (u, v), w in zip(edges.tolist(), weights.tolist()))
+    return g
+
+
+def source_path(fp):
+    """
+    The path of the file fp, None if it is not a file on disk
+    """
+    path = getattr(fp, 'name', None)
+    if not isinstance(path, str) or not os.path.isfile(path):
+        return None
+    return path
+
+
+def is_fresh(source, files):
+    """
+    Whether the files of a binary copy all exist and are newer than the
+    source file
+    """
+    try:
+        mtime = os.path.getmtime(source)
+        return all(os.path.getmtime(f) >= mtime for f in files)
+    except OSError:
+        return False
 
-        if "assignment_costs" not in g.node[u]:
-            g.node[u]["assignment_costs"] = {}
-        g.node[u]["assignment_costs"][v] = c
 
-    return int_only
+def save_array(path, array):
+    """
+    Writes a single array as .npy, or an .npz of the dict array, under a
+    temporary name first so readers never see a partial file
+    """
+    tmp = '{}.{}.tmp'.format(path, os.getpid())
+    try:
+        with open(tmp, 'wb') as f:
+            if isinstance(array, dict):
+                np.savez(f, **array)
+            else:
+                np.save(f, array)
+        os.replace(tmp, path)
+    except OSError:
+        # the cache is only an optimisation, e.g. the directory may be
+        # read only
+        if os.path.exists(tmp):
+            os.remove(tmp)
 
 
-def load_pcstp(fp):
+def load_pcstp(fp, cache=True):
     '''
     Loads an .stp file into a networkX graph
-    '''
-    g = nx.Graph()
-    int_only = True
-    for line in fp:
-        if line.startswith('SECTION'):
-            suffix = line[8:].strip()
 
+    With cache, the parsed arrays are kept next to the file in .pcstp.npz
+    and loaded from there while it is newer than the file.
+    '''
+    path = source_path(fp) if cache else None
+    if path is not None and is_fresh(path, [path + '.pcstp.npz']):
+        with np.load(path + '.pcstp.npz') as data:
+            arrays = {k: data[k] for k in data.files}
+    else:
+        arrays = no_sections()
+        arrays['terminals'] = np.empty(0, dtype=np.int64)
+        arrays['prizes'] = np.empty(0, dtype=np.int64)
+        for suffix, body in sections(fp):
             if suffix == 'Graph':
-                int_only = grow_graph(fp, g)
+                arrays['nodes'], arrays['edges'], arrays['weights'] = \
+                    read_graph(body)
             elif suffix == 'Terminals':
-                N, int_only_N = add_terminal_prizes(fp, g)
-            else:
-                chomp_section(fp)
-    return g, N, (int_only and int_only_N)
+                arrays['terminals'], arrays['prizes'] = read_terminals(body)
+        if path is not None:
+            save_array(path + '.pcstp.npz', arrays)
+
+    g = build_graph(int(arrays['nodes']), arrays['edges'], arrays['weights'])
+    N = set(arrays['terminals'].tolist())
+    for v, p in zip(arrays['terminals'].tolist(), arrays['prizes'].tolist()):
+        g.node[v]['prize'] = g.node[v]['_prize'] = p
+
+    int_only = arrays['weights'].dtype == np.int64 and \
+        arrays['prizes'].dtype == np.int64
+    return g, N, int_only
 
 
-def load_mtp(fp):
+def load_mtp(fp, cache=True):
     '''
     Loads an .stp file in MTP format into a networkX graph
+
+    With cache, the parsed arrays are kept next to the file, in .mtp.npz
+    and the cost matrix in .mtp.npy, and loaded from there while they are
+    newer than the file. The cost matrix is memory mapped copy on write,
+    so processes loading the same instance share it.
     '''
-    g = nx.Graph()
-    int_only = True
-    for line in fp:
-        if line.startswith('SECTION'):
-            suffix = line[8:].strip()
+    path = source_path(fp) if cache else None
+    files = [path + '.mtp.npz', path + '.mtp.npy'] if path else []
+    if path is not None and is_fresh(path, files):
+        with np.load(files[0]) as data:
+            arrays = {k: data[k] for k in data.files}
+        C = np.load(files[1], mmap_mode='c')
+    else:
+        arrays = no_sections()
+        C = None
+        int_only = True
+        for suffix, body in sections(fp):
             if suffix == 'Graph':
-                int_only = grow_graph(fp, g) and int_only
+                arrays['nodes'], arrays['edges'], arrays['weights'] = \
+                    read_graph(body)
+                int_only = arrays['weights'].dtype == np.int64 and int_only
             elif suffix == 'AssignmentCosts':
-                int_only = add_assignment_costs(fp, g) and int_only
-            else:
-                chomp_section(fp)
-    return g, int_only
+                C, int_only_C = read_assignment_costs(body, arrays['nodes'])
+                int_only = int_only_C and int_only
+
+        if C is None:
+            C = empty_cost_matrix(arrays['nodes'])
+        arrays['int_only'] = int_only
+        if path is not None:
+            save_array(files[1], C)
+            save_array(files[0], arrays)
+
+    g = build_graph(int(arrays['nodes']), arrays['edges'], arrays['weights'])
+    g.graph['assignment_costs'] = C
+    return g, bool(arrays['int_only'])
 # Writing:
 
 
-def write_header():
-    print("33D32945 STP File, STP Format Version 1.0")
-    print()
+def open_stp(path, mode='r'):
+    '''
+    Opens an .stp file as text, gzip compressed if the name ends in .gz
+    '''
+    if path.endswith('.gz'):
+        # the default level 9 is several times slower for little gain
+        return gzip.open(path, mode + 't', compresslevel=6)
+    return open(path, mode)
 
 
-def write_graph(g):
+def write_rows(out, key, *columns, block=1 << 16):
+    '''
+    Writes a line of key and the values of the columns for every row,
+    formatting a block of rows at a time
+    '''
+    columns = [c.tolist() if isinstance(c, np.ndarray) else list(c)
+               for c in columns]
+    width = len(columns)
+    line = key + ' %s' * width + '\n'
+    n = len(columns[0])
+    for k in range(0, n, block):
+        m = min(block, n - k)
+        values = [None] * (m * width)
+        for i, column in enumerate(columns):
+            values[i::width] = column[k:k + m]
+        out.write((line * m) % tuple(values))
+
 
-    print("SECTION Graph")
-    print("Nodes", g.number_of_nodes())
-    print("Edges", g.number_of_edges())
-    for u, v, c in g.edges(data="weight"):
-            print("E", u, v, c)
-    print("END")
-    print()
+def write_header(out):
+    out.write("33D32945 STP File, STP Format Version 1.0\n")
+    out.write("\n")
 
 
-def write_assignment_costs(g):
-    print("SECTION AssignmentCosts")
-    for u in g.nodes:
-        for v in g.nodes:
-            if d(g, u, v) < BIG_FLOAT:
-                print("D", u, v, d(g, u, v))
-    print("END")
+def write_graph(g, out):
+    out.write("SECTION Graph\n")
+    out.write("Nodes {}\n".format(g.number_of_nodes()))
+    out.write("Edges {}\n".format(g.number_of_edges()))
+    us, vs, cs = zip(*g.edges(data="weight")) if g.number_of_edges() \
+        else ((), (), ())
+    write_rows(out, "E", us, vs, cs)
+    out.write("END\n")
+    out.write("\n")
 
 
-def write_stp(g):
-    write_header()
-    write_graph(g)
-    write_assignment_costs(g)
+def write_assignment_costs(g, out):
+    C = cost_matrix(g)
+    us, vs = np.nonzero(C < BIG_FLOAT)
+    cs = C[us, vs]
+
+    # write integral costs as integers so they load as int_only again
+    if np.all(cs == np.floor(cs)):
+        cs = cs.astype(np.int64)
+
+    out.write("SECTION AssignmentCosts\n")
+    write_rows(out, "D", us + 1, vs + 1, cs)
+    out.write("END\n")
+
+
+def write_stp(g, out=None):
+    '''
+    Writes g in MTP format to the text stream out, stdout by default
+    '''
+    if out is None:
+        out = sys.stdout
+    write_header(out)
+    write_graph(g, out)
+    write_assignment_costs(g, out)
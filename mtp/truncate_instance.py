@@ -10,7 +10,7 @@ import argparse
 import itertools
 
 import mtp
-from stp import load_mtp, write_stp
+from stp import load_mtp, open_stp, write_stp
 
 
 DESCRIPTION = """
@@ -26,17 +26,24 @@ def main():
     parser.add_argument("-f", help="The mtp instance as a stp file")
     parser.add_argument("--nodes", "-n", help="Desired number of nodes", type=int)
     parser.add_argument("--edges", "-e", help="Desired number of edges", type=int)
+    parser.add_argument("--output", "-o",
+                        help="The stp file to write, gzip compressed if it "
+                        "ends in .gz, stdout by default")
 
     args = parser.parse_args()
 
     if args.f is not None:
-        with open(args.f) as fp:
+        with open_stp(args.f) as fp:
             g, int_only = load_mtp(fp)
     else:
         g, int_only = load_mtp(sys.stdin)
 
     gp = mtp.truncate(g, args.nodes, args.edges)
-    write_stp(gp)
+    if args.output:
+        with open_stp(args.output, "w") as out:
+            write_stp(gp, out)
+    else:
+        write_stp(gp)
 
 
 if __name__ == "__main__":
@@ -5,12 +5,19 @@ import gurobipy as grb
 import numpy as np
 
 import argparse
-import itertools
+import os
+import sys
 
 from pcst_fast import pcst_fast
 
 from stp import load_stp
 
+# The flow network is shared with the MTP solver, mtp/flow.py is the only
+# copy. Appended, so the modules next to this script still come first.
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                             os.pardir, os.pardir, 'mtp'))
+from flow import flow_network  # noqa: E402
+
 DESCRIPTION = """
  Solves an instance of the PCSTP using Gurobi Python.
 """
@@ -50,85 +57,82 @@ def build_ilp_model(g):
     return model, x, y
 
 
-def sum_edges(S, x):
-    lhs = grb.LinExpr()
+def incident_edges(G):
+    """
+    Maps every node to its neighbours along with the key of the edge
+    """
+    incident = {v: [] for v in G.nodes}
+    for i, j in G.edges:
+        incident[i].append((j, (i, j)))
+        incident[j].append((i, (i, j)))
+    return incident
 
-    for i, j in itertools.combinations(S, 2):
-        if (i, j) in x:
-            lhs.add(x[i, j])
-        elif (j, i) in x:
-            lhs.add(x[j, i])
-    return lhs
 
+def induced_edges(S, incident):
+    """
+    The edges of the subgraph induced by S, found through the incidence
+    index instead of all pairs of S
+    """
+    S = set(S)
+    return [e for i in S for j, e in incident[i] if i < j and j in S]
 
-def separate_gsec_rel(model, x, y, x_bar, y_bar, G):
-    F = nx.DiGraph()
 
-    F.add_node(-1)  # source
-    F.add_node(-2)  # sink
-    for v in G.node:
-        F.add_node(v)
+def sum_edges(S, x, incident, x_bar=None):
+    """
+    Sums x over the edges induced by S. Also returns the value of the sum
+    at x_bar, if given, from the same pass.
+    """
+    edges = induced_edges(S, incident)
 
-    for i, j in G.edges:
-        capacity = x_bar[i, j] / 2
-        F.add_edge(i, j, capacity=capacity)
-        F.add_edge(j, i, capacity=capacity)
+    lhs = grb.LinExpr([1.0] * len(edges), [x[e] for e in edges])
+    lhs_bar = sum(x_bar[e] for e in edges) if x_bar is not None else None
+    return lhs, lhs_bar
 
-    total_source_cap = 0
-    for i in G.nodes:
-        node = F.node[i]
 
-        capacity = 0
-        for j in G.adj[i]:
-            capacity += F[i][j]['capacity']
+def separate_gsec_rel(model, x, y, x_bar, y_bar, G):
+    F = model._flow
+    F.set_capacities([x_bar[i, j] for i, j in F.edges],
+                     [y_bar[v] for v in F.nodes])
 
-        node['capacity'] = capacity
-        source_cap = max(capacity - y_bar[i], 0)
-        F.add_edge(-1, i, capacity=source_cap)
-        F.add_edge(i, -2, capacity=max(y_bar[i] - capacity, 0))
+    total_source_cap = F.source_capacity()
 
-        total_source_cap += source_cap
+    # Checking every cut against x_bar is only done when verifying
+    verify = model._verify_cuts
+    false_pos = false_neg = 0
 
     cuts = 0
     # solve max flow problems and collect cuts
-    for i in sorted(F.nodes):
-        if i < 0:
-            continue
-
-        i_capacity = F[-1][i]['capacity']
-        F[-1][i]['capacity'] = float('inf')
-
-        cut_val, cut = nx.minimum_cut(F, _s=-1, _t=-2)
-
-        S, T = cut
+    for i in F.nodes:
+        cut_val, S = F.min_cut(i)
 
         constr = -1 * (cut_val - total_source_cap) + y_bar[i]
 
-        S.discard(-1)
-
         if constr > 0:
             rhs = grb.quicksum(y[v] for v in S if v != i)
-            lhs = sum_edges(S, x)
+            lhs, lhs_bar = sum_edges(S, x, model._incident,
+                                     x_bar if verify else None)
 
             model.cbCut(lhs <= rhs)
             cuts += 1
 
-            rhs_bar = grb.quicksum(y_bar[v] for v in S if v != i)
-            lhs_bar = sum_edges(S, x_bar)
-            if lhs_bar.getValue() <= rhs_bar.getValue():
-                print('not violated: ', lhs_bar.getValue(), '<=', rhs_bar.getValue())
+            if verify and lhs_bar <= \
+               sum(y_bar[v] for v in S if v != i) + EPSILON:
+                false_pos += 1
 
-        else:
-            rhs_bar = grb.quicksum(y_bar[v] for v in S if v != i).getValue()
-            lhs_bar = sum_edges(S, x_bar).getValue()
-            if lhs_bar > rhs_bar:
-                print('violated: ', lhs_bar, '>', rhs_bar)
-
-        F[-1][i]['capacity'] = i_capacity
-        F[i][-2]['capacity'] = float('inf')
+        elif verify:
+            rhs_bar = sum(y_bar[v] for v in S if v != i)
+            lhs_bar = sum(x_bar[e] for e in induced_edges(S, model._incident))
+            if lhs_bar > rhs_bar + EPSILON:
+                false_neg += 1
 
         if cuts >= MAX_CUTS:
-            return cuts
+            break
+
+    if verify:
+        model._cut_check[0] += false_pos
+        model._cut_check[1] += false_neg
+        print("Separation check:", cuts, "cuts,", false_pos,
+              "false positives,", false_neg, "false negatives")
     return cuts
 
 
@@ -136,7 +140,7 @@ def add_gsecs(model, x, y, cycles):
     for cycle in cycles:
         ysum = grb.quicksum(y[v] for v in cycle)
 
-        lhs = sum_edges(cycle, x)
+        lhs, _ = sum_edges(cycle, x, model._incident)
 
         for k in cycle:
             model.cbLazy(lhs <= (ysum - y[k]))
@@ -216,6 +220,8 @@ def main():
     parser = argparse.ArgumentParser(description=DESCRIPTION)
 
     parser.add_argument('pcstp', help='The PCSTP instance as a stp file')
+    parser.add_argument('--verify-cuts', action='store_true', default=False,
+                        help='Report separated cuts that disagree with the node relaxation')
 
     args = parser.parse_args()
 
@@ -239,10 +245,18 @@ def main():
 
     model._int_only = int_only
     model._last_node = 0
+    model._flow = flow_network(g)
+    model._incident = incident_edges(g)
+    model._verify_cuts = args.verify_cuts
+    model._cut_check = [0, 0]
     model.modelSense = grb.GRB.MINIMIZE
 
     model.optimize(lambda m, w: callback(g, x, y, m, w))
 
+    if args.verify_cuts:
+        print("Separation check total:", model._cut_check[0],
+              "false positives,", model._cut_check[1], "false negatives")
+
 
 if __name__ == '__main__':
     main()
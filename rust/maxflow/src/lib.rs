@@ -0,0 +1,400 @@
+//! Max flow kernel for the GSEC separation in mtp/flow.py.
+//!
+//! The network layout is the one of `FlowNetwork`: arcs come in pairs so
+//! the reverse of arc `a` is `a ^ 1`, the source is node `n` and the sink
+//! node `n + 1`. Only residual capacities are stored.
+
+use std::f64;
+use std::slice;
+
+const FLOW_EPSILON: f64 = 1e-9;
+
+pub struct Network {
+    n: usize,
+    head: Vec<usize>,
+    tail: Vec<usize>,
+    adj: Vec<usize>,
+    start: Vec<usize>,
+    cap: Vec<f64>,
+    res: Vec<f64>,
+    value: f64,
+    saved: Vec<f64>,
+    saved_value: f64,
+    level: Vec<i64>,
+    ptr: Vec<usize>,
+    queue: Vec<usize>,
+    path: Vec<usize>,
+}
+
+impl Network {
+    fn new(n: usize, tails: &[i64], heads: &[i64]) -> Network {
+        let nodes = n + 2;
+        let arcs = tails.len();
+
+        let mut start = vec![0; nodes + 1];
+        for &t in tails {
+            start[t as usize + 1] += 1;
+        }
+        for v in 0..nodes {
+            start[v + 1] += start[v];
+        }
+
+        let mut fill = start.clone();
+        let mut adj = vec![0; arcs];
+        for (a, &t) in tails.iter().enumerate() {
+            adj[fill[t as usize]] = a;
+            fill[t as usize] += 1;
+        }
+
+        Network {
+            n: n,
+            head: heads.iter().map(|&h| h as usize).collect(),
+            tail: tails.iter().map(|&t| t as usize).collect(),
+            adj: adj,
+            start: start,
+            cap: vec![0.0; arcs],
+            res: vec![0.0; arcs],
+            value: 0.0,
+            saved: vec![0.0; arcs],
+            saved_value: 0.0,
+            level: vec![-1; nodes],
+            ptr: vec![0; nodes],
+            queue: Vec::with_capacity(nodes),
+            path: Vec::with_capacity(nodes),
+        }
+    }
+
+    fn source(&self) -> usize {
+        self.n
+    }
+
+    fn sink(&self) -> usize {
+        self.n + 1
+    }
+
+    /// Breadth first search on the residual network. Returns whether t
+    /// was reached, `level` holds the distances from s.
+    fn levels(&mut self, s: usize, t: usize) -> bool {
+        for l in self.level.iter_mut() {
+            *l = -1;
+        }
+        self.queue.clear();
+
+        self.level[s] = 0;
+        self.queue.push(s);
+        let mut i = 0;
+        while i < self.queue.len() {
+            let v = self.queue[i];
+            i += 1;
+            for &a in &self.adj[self.start[v]..self.start[v + 1]] {
+                let w = self.head[a];
+                if self.level[w] < 0 && self.res[a] > FLOW_EPSILON {
+                    self.level[w] = self.level[v] + 1;
+                    if w == t {
+                        return true;
+                    }
+                    self.queue.push(w);
+                }
+            }
+        }
+        false
+    }
+
+    /// Dinic's algorithm from s to t sending at most limit.
+    fn augment(&mut self, s: usize, t: usize, limit: f64) -> f64 {
+        let mut total = 0.0;
+        while total < limit - FLOW_EPSILON && self.levels(s, t) {
+            self.ptr.copy_from_slice(&self.start[..self.start.len() - 1]);
+            self.path.clear();
+
+            let mut v = s;
+            while total < limit - FLOW_EPSILON {
+                if v == t {
+                    let mut f = limit - total;
+                    for &a in &self.path {
+                        f = f.min(self.res[a]);
+                    }
+                    for &a in &self.path {
+                        self.res[a] -= f;
+                        self.res[a ^ 1] += f;
+                    }
+                    total += f;
+                    self.path.clear();
+                    v = s;
+                    continue;
+                }
+
+                let end = self.start[v + 1];
+                while self.ptr[v] < end {
+                    let a = self.adj[self.ptr[v]];
+                    if self.res[a] > FLOW_EPSILON && self.level[self.head[a]] == self.level[v] + 1 {
+                        break;
+                    }
+                    self.ptr[v] += 1;
+                }
+
+                if self.ptr[v] < end {
+                    let a = self.adj[self.ptr[v]];
+                    self.path.push(a);
+                    v = self.head[a];
+                } else if v == s {
+                    break;
+                } else {
+                    // dead end, retreat
+                    self.level[v] = -1;
+                    let a = self.path.pop().unwrap();
+                    v = self.tail[a];
+                    self.ptr[v] += 1;
+                }
+            }
+        }
+        total
+    }
+
+    fn source_side(&mut self, side: &mut [u8]) {
+        for s in side.iter_mut() {
+            *s = 0;
+        }
+        self.queue.clear();
+
+        let source = self.source();
+        side[source] = 1;
+        self.queue.push(source);
+        let mut i = 0;
+        while i < self.queue.len() {
+            let v = self.queue[i];
+            i += 1;
+            for &a in &self.adj[self.start[v]..self.start[v + 1]] {
+                let w = self.head[a];
+                if side[w] == 0 && self.res[a] > FLOW_EPSILON {
+                    side[w] = 1;
+                    self.queue.push(w);
+                }
+            }
+        }
+    }
+
+    /// Marks the nodes that can not reach the sink in the residual network,
+    /// the source side of the min cut with the most nodes.
+    fn back_side(&mut self, side: &mut [u8]) {
+        for s in side.iter_mut() {
+            *s = 1;
+        }
+        self.queue.clear();
+
+        let sink = self.sink();
+        side[sink] = 0;
+        self.queue.push(sink);
+        let mut i = 0;
+        while i < self.queue.len() {
+            let w = self.queue[i];
+            i += 1;
+            // v reaches w if the reverse of an arc out of w has capacity
+            for &a in &self.adj[self.start[w]..self.start[w + 1]] {
+                let v = self.head[a];
+                if side[v] == 1 && self.res[a ^ 1] > FLOW_EPSILON {
+                    side[v] = 0;
+                    self.queue.push(v);
+                }
+            }
+        }
+    }
+
+    /// Adds `amount` to the capacity of the first `arcs` arcs that leave
+    /// the source side `side` and sends the flow that allows.
+    fn nest(&mut self, side: &[u8], arcs: usize, amount: f64) -> f64 {
+        for a in 0..arcs {
+            if side[self.tail[a]] == 1 && side[self.head[a]] == 0 {
+                self.res[a] += amount;
+            }
+        }
+        let (source, sink) = (self.source(), self.sink());
+        self.augment(source, sink, f64::INFINITY)
+    }
+
+    fn save(&mut self) {
+        self.saved.copy_from_slice(&self.res);
+        self.saved_value = self.value;
+    }
+
+    fn restore(&mut self) {
+        self.res.copy_from_slice(&self.saved);
+        self.value = self.saved_value;
+    }
+
+    fn open_cut(&mut self, s_arc: usize) -> f64 {
+        let (source, sink) = (self.source(), self.sink());
+
+        self.res[s_arc] = f64::INFINITY;
+        self.value += self.augment(source, sink, f64::INFINITY);
+        self.value
+    }
+
+    fn close_cut(&mut self, k: usize, s_arc: usize, t_arc: usize) {
+        let sink = self.sink();
+
+        let flow = self.res[s_arc ^ 1];
+        let capacity = self.cap[s_arc];
+        if flow > capacity {
+            self.res[s_arc] = 0.0;
+            self.res[s_arc ^ 1] = capacity;
+            self.value -= flow - capacity;
+            self.augment(sink, k, flow - capacity);
+        } else {
+            self.res[s_arc] = capacity - flow;
+        }
+
+        self.res[t_arc] = f64::INFINITY;
+    }
+
+    fn min_cut(&mut self, k: usize, s_arc: usize, t_arc: usize, side: &mut [u8]) -> f64 {
+        let cut_val = self.open_cut(s_arc);
+        self.source_side(side);
+        self.close_cut(k, s_arc, t_arc);
+        cut_val
+    }
+}
+
+/// Creates a network on `n` nodes plus source and sink from `arcs` arcs
+/// given by their tails and heads.
+#[no_mangle]
+pub unsafe extern "C" fn network_new(n: usize, arcs: usize, tails: *const i64, heads: *const i64) -> *mut Network {
+    let tails = slice::from_raw_parts(tails, arcs);
+    let heads = slice::from_raw_parts(heads, arcs);
+    Box::into_raw(Box::new(Network::new(n, tails, heads)))
+}
+
+#[no_mangle]
+pub unsafe extern "C" fn network_free(net: *mut Network) {
+    if !net.is_null() {
+        drop(Box::from_raw(net));
+    }
+}
+
+/// Sets the arc capacities and clears the flow.
+#[no_mangle]
+pub unsafe extern "C" fn network_set_capacities(net: *mut Network, cap: *const f64) {
+    let net = &mut *net;
+    let cap = slice::from_raw_parts(cap, net.cap.len());
+    net.cap.copy_from_slice(cap);
+    net.res.copy_from_slice(cap);
+    net.value = 0.0;
+}
+
+/// Min cut with node k forced to the source side through `s_arc`, starting
+/// from the current flow. Writes the source side to `side` (n + 2 bytes)
+/// and returns the cut value. Afterwards k is forced to the sink side
+/// through `t_arc`.
+#[no_mangle]
+pub unsafe extern "C" fn network_min_cut(net: *mut Network, k: usize, s_arc: usize, t_arc: usize, side: *mut u8) -> f64 {
+    let net = &mut *net;
+    let side = slice::from_raw_parts_mut(side, net.n + 2);
+    net.min_cut(k, s_arc, t_arc, side)
+}
+
+/// The first half of `network_min_cut`: forces k to the source side
+/// through `s_arc` and returns the min cut value. The cuts of the flow can
+/// then be read before `network_close_cut`.
+#[no_mangle]
+pub unsafe extern "C" fn network_open_cut(net: *mut Network, s_arc: usize) -> f64 {
+    let net = &mut *net;
+    net.open_cut(s_arc)
+}
+
+/// The second half of `network_min_cut`: forces k to the sink side.
+#[no_mangle]
+pub unsafe extern "C" fn network_close_cut(net: *mut Network, k: usize, s_arc: usize, t_arc: usize) {
+    let net = &mut *net;
+    net.close_cut(k, s_arc, t_arc)
+}
+
+/// Writes the source side of the min cut with the fewest nodes to `side`.
+#[no_mangle]
+pub unsafe extern "C" fn network_source_side(net: *mut Network, side: *mut u8) {
+    let net = &mut *net;
+    let side = slice::from_raw_parts_mut(side, net.n + 2);
+    net.source_side(side)
+}
+
+/// Writes the source side of the min cut with the most nodes to `side`.
+#[no_mangle]
+pub unsafe extern "C" fn network_back_side(net: *mut Network, side: *mut u8) {
+    let net = &mut *net;
+    let side = slice::from_raw_parts_mut(side, net.n + 2);
+    net.back_side(side)
+}
+
+/// Raises the capacity of the first `arcs` arcs leaving `side` by
+/// `amount` and augments. Returns the flow added.
+#[no_mangle]
+pub unsafe extern "C" fn network_nest(net: *mut Network, side: *const u8, arcs: usize, amount: f64) -> f64 {
+    let net = &mut *net;
+    let side = slice::from_raw_parts(side, net.n + 2);
+    net.nest(side, arcs, amount)
+}
+
+/// Keeps a copy of the flow, to undo nesting with `network_restore`.
+#[no_mangle]
+pub unsafe extern "C" fn network_save(net: *mut Network) {
+    let net = &mut *net;
+    net.save()
+}
+
+#[no_mangle]
+pub unsafe extern "C" fn network_restore(net: *mut Network) {
+    let net = &mut *net;
+    net.restore()
+}
+
+#[cfg(test)]
+mod tests {
+    use super::*;
+
+    #[test]
+    fn path_cut() {
+        // 0 - 1 with capacity 1 each way, source to 0 and 1, 1 to sink
+        let tails = [0, 1, 2, 0, 2, 1, 0, 3, 1, 3];
+        let heads = [1, 0, 0, 2, 1, 2, 3, 0, 3, 1];
+        let mut net = Network::new(2, &tails, &heads);
+        let cap = [1.0, 1.0, 0.0, 0.0, 0.5, 0.0, 0.0, 0.0, 2.0, 0.0];
+        net.cap.copy_from_slice(&cap);
+        net.res.copy_from_slice(&cap);
+
+        let mut side = [0; 4];
+        let val = net.min_cut(0, 2, 6, &mut side);
+        assert!((val - 1.5).abs() < 1e-9);
+        assert_eq!(side, [1, 0, 1, 0]);
+    }
+
+    #[test]
+    fn back_and_nested_cuts() {
+        // path 0 - 1 - 2 with capacity 1, 2 and 1 to the sink, so {0} and
+        // {0, 1, 2} are both min cuts
+        let tails = [0, 1, 1, 2, 3, 0, 3, 1, 3, 2, 0, 4, 1, 4, 2, 4];
+        let heads = [1, 0, 2, 1, 0, 3, 1, 3, 2, 3, 4, 0, 4, 1, 4, 2];
+        let mut net = Network::new(3, &tails, &heads);
+        let cap = [1.0, 1.0, 2.0, 2.0, 0.0, 0.0, 0.0, 0.0, 0.0, 0.0, 0.0, 0.0,
+                   0.0, 0.0, 1.0, 0.0];
+        net.cap.copy_from_slice(&cap);
+        net.res.copy_from_slice(&cap);
+
+        let val = net.open_cut(4);
+        assert!((val - 1.0).abs() < 1e-9);
+
+        let mut side = [0; 5];
+        net.source_side(&mut side);
+        assert_eq!(side, [1, 0, 0, 1, 0]);
+        net.back_side(&mut side);
+        assert_eq!(side, [1, 1, 1, 1, 0]);
+
+        net.save();
+        net.source_side(&mut side);
+        net.nest(&side, 4, 1.0);
+        net.source_side(&mut side);
+        assert_eq!(side, [1, 1, 1, 1, 0]);
+        net.restore();
+        assert!((net.value - 1.0).abs() < 1e-9);
+
+        net.close_cut(0, 4, 10);
+    }
+}
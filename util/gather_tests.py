@@ -14,6 +14,19 @@ class TestCase(object):
     heuristics = None
     max_cuts = None
 
+    # options that change the model or the search, in the name of the
+    # series directory only when they are not the default
+    start = 0
+    local_search = 0
+    prune = True
+    lazy_linking = False
+    back_cuts = False
+    nested_cuts = 0
+    min_cardinality = False
+    separation_interval = None
+    separation_nodes = None
+    separation_share = None
+
     def __init__(self, runs, path):
 
         self.opt = True
@@ -49,6 +62,9 @@ class TestCase(object):
         exploded = series_with_keys.split("-")
 
         self.series = "-".join(exploded[:2])
+        # the options past the compared ones, the tables only use runs
+        # without any
+        self.options = []
 
         for opt in exploded[2:]:
 
@@ -62,6 +78,29 @@ class TestCase(object):
                 self.strengthen = False
             elif opt == "s+":
                 self.strengthen = True
+            else:
+                self.options.append(opt)
+
+                if opt.startswith("ST"):
+                    self.start = float(opt[2:])
+                elif opt.startswith("LS"):
+                    self.local_search = float(opt[2:])
+                elif opt == "NP":
+                    self.prune = False
+                elif opt == "LL":
+                    self.lazy_linking = True
+                elif opt == "BC":
+                    self.back_cuts = True
+                elif opt.startswith("NC"):
+                    self.nested_cuts = int(opt[2:])
+                elif opt == "CARD":
+                    self.min_cardinality = True
+                elif opt.startswith("SI"):
+                    self.separation_interval = int(opt[2:])
+                elif opt.startswith("SN"):
+                    self.separation_nodes = int(opt[2:])
+                elif opt.startswith("SS"):
+                    self.separation_share = float(opt[2:])
 
         # Extract Name
 
@@ -91,7 +130,8 @@ def read_test(path):
     runs = []
     with open(path) as f:
         for line in f:
-            n, m, st, t, b, v = line.split()
+            # newer runs add the parse and build times, t is the solve time
+            n, m, st, t, b, v = line.split()[:6]
 
             runs.append((int(n), int(m), ST[st], float(t), float(b), float(v)))
 
@@ -176,7 +216,7 @@ def print_ending():
 def get_max_cuts(tcs):
 
     for t in tcs:
-        if t.heuristics or t.strengthen:
+        if t.heuristics or t.strengthen or t.options:
             continue
         if t.max_cuts == 0:
             zero = t
@@ -190,7 +230,7 @@ def get_max_cuts(tcs):
 def get_heuristics(tcs, mc):
 
     for t in tcs:
-        if not t.max_cuts == mc and not t.strengthen:
+        if (not t.max_cuts == mc and not t.strengthen) or t.options:
             continue
         if t.heuristics:
             plus = t
@@ -201,7 +241,7 @@ def get_heuristics(tcs, mc):
 
 def get_strengthen(tcs, mc):
     for t in tcs:
-        if t.heuristics or not t.max_cuts == mc:
+        if t.heuristics or not t.max_cuts == mc or t.options:
             continue
         if t.strengthen:
             plus = t